@@ -0,0 +1,77 @@
+"""Backfill grade files posted to monitored channels while the service was not listening.
+
+Walks each channel's history oldest-first and processes every grade file through the
+normal pipeline, checkpointing per channel so an interrupted run resumes where it
+stopped. Stop the main service first (both use the userbot session), or trigger the
+backfill from the dashboard instead.
+
+    python backfill.py                       # every active monitored channel
+    python backfill.py --channel -100123 --no-notify
+"""
+import os
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+import json
+import asyncio
+import argparse
+import logging
+from telethon import TelegramClient
+from config import API_ID, API_HASH, ensure_data_dirs
+from modules.database import db, adb
+from modules.directory import directory
+from modules.jobs import job_queue
+from modules.backfill import backfiller
+from modules.notifier import pool
+from modules import analytics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stdout
+)
+logger = logging.getLogger("BackfillCLI")
+
+async def run(args):
+    if not API_ID or not API_HASH:
+        logger.error("TELEGRAM_API_ID or TELEGRAM_API_HASH not found.")
+        return
+    ensure_data_dirs()
+    await adb.run(db.start_replication, timeout=300)
+    await adb.run(directory.load)
+
+    client = TelegramClient('userbot_session', int(API_ID), API_HASH)
+    await client.start()
+    notify = not args.no_notify
+    if notify and pool:
+        await pool.start()
+    try:
+        backfiller.attach(client)
+        status = await backfiller.run(args.channel or None, notify=notify, limit=args.limit, reset=args.reset)
+        print(json.dumps(status, indent=2))
+    finally:
+        await job_queue.stop()
+        if pool:
+            await pool.stop()
+        await client.disconnect()
+        analytics.shutdown()
+        adb.shutdown()
+        db.stop_replication()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--channel', type=int, action='append',
+                        help='channel id to backfill (repeatable; default: all active monitored channels)')
+    parser.add_argument('--no-notify', action='store_true', help='store grades and charts without messaging students')
+    parser.add_argument('--limit', type=int, default=None, help='at most this many documents per channel')
+    parser.add_argument('--reset', action='store_true', help='ignore saved checkpoints and start from the beginning')
+    try:
+        asyncio.run(run(parser.parse_args()))
+    except KeyboardInterrupt:
+        logger.info("Interrupted; the next run resumes from the last checkpoint.")
+
+if __name__ == "__main__":
+    main()
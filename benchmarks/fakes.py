@@ -0,0 +1,217 @@
+import time
+import asyncio
+import random
+import threading
+from datetime import datetime, timezone
+from telethon import errors
+from postgrest.exceptions import APIError
+
+# Natural primary keys from schema.sql; like PostgREST, upsert() without on_conflict
+# only merges on the primary key, so tables keyed by a SERIAL id just insert
+PRIMARY_KEYS = {
+    'settings': ('key',),
+    'backfill_checkpoints': ('channel_id',),
+    'subject_snapshots': ('subject_name',),
+    'student_aggregates': ('student_id',),
+}
+
+# UNIQUE constraints from schema.sql; an insert that violates one fails as in Postgres
+UNIQUE_KEYS = {
+    'users': (('student_id',), ('tg_id',)),
+    'grades': (('student_id', 'subject_name', 'file_hash'),),
+    'processed_files': (('file_hash',),),
+    'grade_summaries': (('subject_name', 'file_hash'),),
+    'channels': (('channel_id',),),
+}
+
+# Telegram rejects albums with more media than this
+ALBUM_LIMIT = 10
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+class FakeQuery:
+    """The subset of the postgrest query builder the Database layer uses."""
+
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self._columns = None
+        self._filters = []
+        self._order = None
+        self._limit = None
+        self._offset = 0
+        self._write = None
+
+    def select(self, columns='*'):
+        self._columns = None if columns == '*' else [c.strip() for c in columns.split(',')]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: str(row.get(column)) == str(value))
+        return self
+
+    def gt(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def lt(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def in_(self, column, values):
+        wanted = {str(v) for v in values}
+        self._filters.append(lambda row: str(row.get(column)) in wanted)
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def insert(self, data):
+        self._write = ('insert', data if isinstance(data, list) else [data], None)
+        return self
+
+    def upsert(self, data, on_conflict=None):
+        keys = tuple(k.strip() for k in on_conflict.split(',')) if on_conflict else PRIMARY_KEYS.get(self.table)
+        self._write = ('upsert', data if isinstance(data, list) else [data], keys)
+        return self
+
+    def execute(self):
+        return self.store._execute(self)
+
+class FakeSupabase:
+    """In-process table store that stands in for the Supabase client.
+
+    `latency` seconds are slept per request to model the network round-trip.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.tables = {}
+        self.requests = 0
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def _execute(self, query):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            rows = self.tables.setdefault(query.table, [])
+            if query._write:
+                return FakeResponse(self._apply_write(query.table, rows, *query._write))
+
+            result = [r for r in rows if all(f(r) for f in query._filters)]
+            if query._order:
+                column, desc = query._order
+                result.sort(key=lambda r: r.get(column) or '', reverse=desc)
+            if query._limit is not None:
+                result = result[query._offset:query._offset + query._limit]
+            if query._columns:
+                result = [{c: r.get(c) for c in query._columns} for r in result]
+            return FakeResponse([dict(r) for r in result])
+
+    def _index(self, table, rows, keys):
+        # Hash index per key so bulk writes stay O(rows)
+        index = self._indexes.get((table, keys))
+        if index is None:
+            index = self._indexes[(table, keys)] = {tuple(r.get(k) for k in keys): r for r in rows}
+        return index
+
+    def _apply_write(self, table, rows, mode, data, keys):
+        unique = [k for k in (PRIMARY_KEYS.get(table),) + UNIQUE_KEYS.get(table, ()) if k]
+        written = []
+        for item in data:
+            item = dict(item)
+            item.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+            existing = self._index(table, rows, keys).get(tuple(item.get(k) for k in keys)) if mode == 'upsert' and keys else None
+            target = dict(existing or {}, **item)
+            for key in unique:
+                values = tuple(target.get(k) for k in key)
+                other = None if None in values else self._index(table, rows, key).get(values)
+                if other is not None and other is not existing:
+                    raise APIError({'code': '23505', 'message':
+                                    f'duplicate key value violates unique constraint on {table} ({", ".join(key)})'})
+            if existing is not None:
+                for (name, index_keys), index in self._indexes.items():
+                    if name == table:
+                        index.pop(tuple(existing.get(k) for k in index_keys), None)
+                existing.update(item)
+                item = existing
+            else:
+                item['id'] = len(rows) + 1
+                rows.append(item)
+            for (name, index_keys), index in self._indexes.items():
+                if name == table:
+                    index[tuple(item.get(k) for k in index_keys)] = item
+            written.append(dict(item))
+        return written
+
+class FakeMedia:
+    """Uploaded media returned on a sent message, reusable as `file=` without another upload."""
+
+    def __init__(self, path):
+        self.path = path
+
+class FakeMessage:
+    def __init__(self, chat_id, message, photo=None):
+        self.chat_id = chat_id
+        self.message = message
+        self.photo = photo
+
+class FakeTelegramClient:
+    """Records send_message calls with simulated latency and occasional FloodWaits.
+
+    Sending a file path counts as an upload (`upload_latency` extra) and returns a
+    message whose `photo` can be passed back in as `file=` to reuse it. A list of
+    files is an album and, as on Telegram, may hold at most ALBUM_LIMIT items.
+    """
+
+    def __init__(self, latency=0.02, flood_wait_rate=0.0, flood_wait_seconds=1, upload_latency=0.1, seed=None):
+        self.latency = latency
+        self.upload_latency = upload_latency
+        self.uploads = 0
+        self.flood_wait_rate = flood_wait_rate
+        self.flood_wait_seconds = flood_wait_seconds
+        self.sent = []
+        self.flood_waits = 0
+        self._rng = random.Random(seed)
+
+    def is_connected(self):
+        return True
+
+    async def disconnect(self):
+        pass
+
+    async def send_message(self, chat_id, message, file=None):
+        await asyncio.sleep(self.latency)
+        if self.flood_wait_rate and self._rng.random() < self.flood_wait_rate:
+            self.flood_waits += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_wait_seconds)
+        if isinstance(file, list) and len(file) > ALBUM_LIMIT:
+            raise errors.MultiMediaTooLongError(request=None)
+        self.sent.append((chat_id, message, file))
+        if isinstance(file, list):
+            # Albums come back as one message per attachment
+            return [FakeMessage(chat_id, message, await self._upload(f)) for f in file]
+        return FakeMessage(chat_id, message, await self._upload(file))
+
+    async def _upload(self, file):
+        if not isinstance(file, str):
+            return file
+        await asyncio.sleep(self.upload_latency)
+        self.uploads += 1
+        return FakeMedia(file)
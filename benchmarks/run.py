@@ -0,0 +1,164 @@
+"""End-to-end benchmark of the grade pipeline, fully offline.
+
+Drives process_file -> chart rendering -> notify_student against an in-process
+Supabase stand-in and a fake Telegram client, then reports per-stage timings,
+files/min, notifications/sec and peak RSS.
+
+    python -m benchmarks.run --files 3 --rows 5000 --registered 0.3
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+# Blank credentials so nothing reaches the real Supabase or Telegram (dotenv won't override them)
+for var in ('SUPABASE_URL', 'SUPABASE_KEY', 'TELEGRAM_API_ID', 'TELEGRAM_API_HASH', 'TELEGRAM_BOT_TOKEN'):
+    os.environ[var] = ''
+
+class StageTimer:
+    """Collects wall-clock samples per pipeline stage."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.spans = {}
+
+    def _record(self, name, start):
+        end = time.perf_counter()
+        self.samples[name].append(end - start)
+        first, last = self.spans.get(name, (start, end))
+        self.spans[name] = (min(first, start), max(last, end))
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._record(name, start)
+        return timed
+
+    def wrap_async(self, name, func):
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self._record(name, start)
+        return timed
+
+    def report(self):
+        lines = [f"{'stage':<12}{'calls':>8}{'total s':>10}{'mean ms':>10}{'p95 ms':>10}"]
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            lines.append(f"{name:<12}{len(samples):>8}{sum(samples):>10.2f}"
+                         f"{1000 * sum(samples) / len(samples):>10.1f}{1000 * p95:>10.1f}")
+        return "\n".join(lines)
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its (pool) children, in MB."""
+    to_mb = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / to_mb,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / to_mb)
+
+async def run(args):
+    from benchmarks.synthetic import make_grade_file
+    from benchmarks.fakes import FakeSupabase, FakeTelegramClient
+    from config import NOTIFY_GLOBAL_RATE, ensure_data_dirs
+    from modules.database import db
+    from modules.directory import directory
+    from modules.botpool import BotPool, BotShard
+    from modules import engine, notifier
+
+    ensure_data_dirs()
+    workdir = tempfile.mkdtemp(prefix='grades-bench-')
+    if args.db == 'sqlite':
+        from modules.sqlite_store import SQLiteClient
+        store = SQLiteClient(os.path.join(workdir, 'bench.db'))
+    else:
+        store = FakeSupabase(latency=args.db_latency)
+    db.client = store
+    clients = [FakeTelegramClient(latency=args.send_latency, flood_wait_rate=args.flood_wait_rate, seed=args.seed + i)
+               for i in range(args.bots)]
+    pool = BotPool([BotShard(i + 1, client, global_rate=args.send_rate or NOTIFY_GLOBAL_RATE)
+                    for i, client in enumerate(clients)])
+    notifier.pool = pool
+
+    timer = StageTimer()
+    engine.read_grade_file = timer.wrap('parse', engine.read_grade_file)
+    engine.analyze_workbook = timer.wrap_async('parse', engine.analyze_workbook)
+    engine.renderer.render = timer.wrap_async('charts', engine.renderer.render)
+    db.add_grades_bulk = timer.wrap('db_write', db.add_grades_bulk)
+    notifier.notify_student = timer.wrap_async('notify', notifier.notify_student)
+    notifier.notify_student_results = timer.wrap_async('notify', notifier.notify_student_results)
+    process_file = timer.wrap_async('file', engine.process_file)
+
+    paths = []
+    for i in range(args.files):
+        path = os.path.join(workdir, f"Subject{i}.{args.format}")
+        numbers = make_grade_file(path, rows=args.rows, extra_columns=args.columns,
+                                  id_format=args.id_format, seed=args.seed + i, sheets=args.sheets)
+        registered = numbers[:int(len(numbers) * args.registered)]
+        store.table('users').upsert([
+            {'student_id': str(n), 'tg_id': str(n), 'full_name': f"Student {n}",
+             'bot_id': pool.home_shard(n).bot_id} for n in registered
+        ]).execute()
+        paths.append(path)
+    directory.load()
+    requests_before = getattr(store, 'requests', 0)
+
+    start = time.perf_counter()
+    for path in paths:
+        await process_file(path, 'benchmark')
+    elapsed = time.perf_counter() - start
+
+    await pool.stop()
+    engine.renderer.shutdown()
+
+    sent = sum(len(client.sent) for client in clients)
+    notify_span = timer.spans.get('notify', (0, 0))
+    notify_seconds = (notify_span[1] - notify_span[0]) or float('nan')
+    rss_self, rss_children = peak_rss_mb()
+    print(timer.report())
+    sheets = f" x {args.sheets} sheets" if args.sheets > 1 else ''
+    print(f"\nfiles: {args.files}{sheets} x {args.rows} rows ({args.format}, {args.id_format} IDs) in {elapsed:.2f}s")
+    print(f"files/min:          {60 * args.files / elapsed:.1f}")
+    print(f"notifications/sec:  {sent / notify_seconds:.1f} ({sent} sent over {args.bots} bots, "
+          f"{sum(c.uploads for c in clients)} uploads, {sum(c.flood_waits for c in clients)} FloodWaits)")
+    if args.db == 'fake':
+        print(f"db requests:        {store.requests - requests_before}")
+    print(f"peak RSS:           {rss_self:.0f} MB (workers {rss_children:.0f} MB)")
+
+def main():
+    from benchmarks.synthetic import ID_FORMATS
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=3)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--columns', type=int, default=10, help='extra columns per sheet')
+    parser.add_argument('--format', choices=('csv', 'xlsx'), default='csv')
+    parser.add_argument('--sheets', type=int, default=1, help='sheets (subjects) per workbook; implies --format xlsx')
+    parser.add_argument('--id-format', choices=ID_FORMATS, default='plain')
+    parser.add_argument('--registered', type=float, default=0.25, help='fraction of IDs registered as users')
+    parser.add_argument('--db', choices=('fake', 'sqlite'), default='fake',
+                        help="'fake': in-memory Supabase stand-in with --db-latency; 'sqlite': the embedded backend")
+    parser.add_argument('--db-latency', type=float, default=0.05, help='seconds per simulated DB request')
+    parser.add_argument('--send-latency', type=float, default=0.05, help='seconds per simulated send')
+    parser.add_argument('--send-rate', type=float, default=None, help='dispatcher global messages/s (default NOTIFY_GLOBAL_RATE)')
+    parser.add_argument('--bots', type=int, default=1, help='notifier bots in the pool (each with its own rate limit)')
+    parser.add_argument('--flood-wait-rate', type=float, default=0.0, help='probability a send raises FloodWait')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.sheets > 1:
+        args.format = 'xlsx'
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import random
+import pandas as pd
+
+ID_FORMATS = ('plain', 'zero_padded', 'float')
+
+def format_student_id(number, id_format):
+    if id_format == 'zero_padded':
+        return f"{number:09d}"
+    if id_format == 'float':
+        # What Excel hands us when an ID column is numeric
+        return f"{number}.0"
+    return str(number)
+
+def make_grade_file(path, rows=2000, extra_columns=10, id_format='plain',
+                    withdrawal_rate=0.03, seed=None, sheets=1):
+    """Writes a synthetic grade sheet (CSV or XLSX, chosen by extension).
+
+    With `sheets` > 1 an XLSX workbook gets one sheet per course ("Course 1", ...)
+    for the same students with independent grades. Returns the list of integer
+    student numbers written, so callers can register a subset of them as users.
+    """
+    rng = random.Random(seed)
+    numbers = rng.sample(range(20_000_000, 29_999_999), rows)
+
+    def make_sheet():
+        grades = [
+            0 if rng.random() < withdrawal_rate else round(min(100, max(1, rng.gauss(68, 14))), 1)
+            for _ in range(rows)
+        ]
+        data = {
+            'Name': [f"Student {n}" for n in numbers],
+            'Student ID': [format_student_id(n, id_format) for n in numbers],
+            'Final Grade': grades,
+        }
+        for i in range(extra_columns):
+            data[f"Extra {i}"] = [rng.randint(0, 100) for _ in range(rows)]
+        return pd.DataFrame(data)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith('.xlsx'):
+        with pd.ExcelWriter(path) as writer:
+            for i in range(max(1, sheets)):
+                make_sheet().to_excel(writer, sheet_name=f"Course {i + 1}" if sheets > 1 else 'Sheet1', index=False)
+    else:
+        make_sheet().to_csv(path, index=False)
+    return numbers
@@ -7,11 +7,45 @@ load_dotenv()
 API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
 BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
+# Comma-separated pool of notifier bots; the first is the primary (defaults to TELEGRAM_BOT_TOKEN)
+BOT_TOKENS = [t.strip() for t in os.getenv('TELEGRAM_BOT_TOKENS', BOT_TOKEN or '').split(',') if t.strip()]
 
 # Supabase Credentials
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 
+# Storage Backend Settings
+DB_BACKEND = os.getenv('DB_BACKEND', 'supabase')                       # 'supabase' or 'sqlite'
+SQLITE_PATH = os.getenv('SQLITE_PATH', os.path.join('data', 'grades.db'))
+DB_REPLICATE = os.getenv('DB_REPLICATE', 'true').lower() in ('1', 'true', 'yes')  # sqlite: sync writes to Supabase
+REPLICATION_INTERVAL = float(os.getenv('REPLICATION_INTERVAL', '5'))   # seconds between write-behind passes
+REPLICATION_BATCH_SIZE = int(os.getenv('REPLICATION_BATCH_SIZE', '500'))  # rows per replicated request
+
+# Async Database Settings
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))       # threads serving awaitable DB calls
+DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', '15'))        # seconds per awaited DB call
+
+# Cache Settings
+SETTINGS_CACHE_TTL = int(os.getenv('SETTINGS_CACHE_TTL', '60'))  # seconds
+
+# Bulk Write Settings
+GRADE_BATCH_SIZE = int(os.getenv('GRADE_BATCH_SIZE', '500'))
+GRADE_BATCH_RETRIES = int(os.getenv('GRADE_BATCH_RETRIES', '3'))
+GRADE_WRITE_TIMEOUT = float(os.getenv('GRADE_WRITE_TIMEOUT', '300'))  # seconds to await a file's bulk write, retries included
+
+# Notification Dispatch Settings
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '8'))
+NOTIFY_GLOBAL_RATE = float(os.getenv('NOTIFY_GLOBAL_RATE', '25'))    # messages/s across all chats
+NOTIFY_PER_CHAT_RATE = float(os.getenv('NOTIFY_PER_CHAT_RATE', '1'))  # messages/s to one chat
+NOTIFY_MAX_RETRIES = int(os.getenv('NOTIFY_MAX_RETRIES', '3'))
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', '10000'))
+MEDIA_CACHE_SIZE = int(os.getenv('MEDIA_CACHE_SIZE', '5000'))  # uploaded charts remembered for reuse
+NOTIFY_CHAT_BUCKETS = int(os.getenv('NOTIFY_CHAT_BUCKETS', '10000'))  # per-chat rate limiters kept before idle ones are dropped
+NOTIFY_DEAD_LETTERS = int(os.getenv('NOTIFY_DEAD_LETTERS', '1000'))   # most recent failed notifications kept for inspection
+
+# Student Directory Settings
+DIRECTORY_REFRESH_INTERVAL = int(os.getenv('DIRECTORY_REFRESH_INTERVAL', '300'))  # seconds
+
 # Admin Settings (Used for internal auth if needed)
 ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', 'admin123')
 SECRET_KEY = os.getenv('SECRET_KEY', 'super-secret-key')
@@ -21,12 +55,60 @@ DATA_DIR = 'data'
 DOWNLOAD_DIR = os.path.join(DATA_DIR, 'downloads')
 CHART_DIR = os.path.join(DATA_DIR, 'charts')
 
+# Deployment Settings
+# 'all' runs the dashboard thread and Telegram services in one process (small deployments);
+# 'telegram' runs only the Telegram orchestrator; 'dashboard' runs the dashboard under gunicorn
+RUN_MODE = os.getenv('RUN_MODE', 'all')
+DASHBOARD_WORKERS = int(os.getenv('DASHBOARD_WORKERS', '3'))
+CONTROL_HOST = os.getenv('CONTROL_HOST', '127.0.0.1')   # orchestrator control channel bind address
+CONTROL_PORT = int(os.getenv('CONTROL_PORT', '8081'))
+ORCHESTRATOR_URL = os.getenv('ORCHESTRATOR_URL', '')      # set on dashboard workers, e.g. http://127.0.0.1:8081
+
+# Startup Settings
+# 'background' loads pandas/matplotlib/scipy after the clients connect; 'lazy' waits for the first file
+ANALYTICS_WARMUP = os.getenv('ANALYTICS_WARMUP', 'background')
+
+# Ingestion Settings
+INGEST_ENGINE = os.getenv('INGEST_ENGINE', 'pandas')  # 'pandas' or 'polars'
+CSV_CHUNK_ROWS = int(os.getenv('CSV_CHUNK_ROWS', '50000'))
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', os.getenv('PDF_WORKERS', '4')))  # processes for PDF pages and workbook sheets
+PDF_PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', '5'))
+# How chart and ingest worker processes start: 'forkserver' (or 'spawn') never forks the threaded main process
+WORKER_START_METHOD = os.getenv('WORKER_START_METHOD', 'forkserver')
+
+# Download Settings
+DOWNLOAD_MEMORY_LIMIT_MB = float(os.getenv('DOWNLOAD_MEMORY_LIMIT_MB', '10'))  # smaller files never touch the disk
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', '4'))                      # parallel part downloads for large files
+DOWNLOAD_RETENTION_SECONDS = int(os.getenv('DOWNLOAD_RETENTION_SECONDS', '3600'))  # leftover downloads older than this are deleted
+DOWNLOAD_DIR_MAX_MB = int(os.getenv('DOWNLOAD_DIR_MAX_MB', '1000'))             # oldest leftovers go first above this
+
+# File Job Queue Settings
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))          # files processed concurrently
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', '50'))   # queued files before the listener waits
+JOB_HISTORY = int(os.getenv('JOB_HISTORY', '200'))        # finished jobs kept for the dashboard
+
+# History Backfill Settings
+BACKFILL_BATCH_SIZE = int(os.getenv('BACKFILL_BATCH_SIZE', '10'))            # documents per checkpointed batch
+BACKFILL_WAIT_SECONDS = float(os.getenv('BACKFILL_WAIT_SECONDS', '1'))       # pause between history pages
+
+# Channel Subscription Settings
+CHANNEL_REFRESH_INTERVAL = int(os.getenv('CHANNEL_REFRESH_INTERVAL', '60'))  # seconds between re-reads
+
+# Chart Rendering Settings
+CHART_WORKERS = int(os.getenv('CHART_WORKERS', '2'))
+CHART_WIDTH = float(os.getenv('CHART_WIDTH', '10'))   # inches
+CHART_HEIGHT = float(os.getenv('CHART_HEIGHT', '6'))  # inches
+CHART_DPI = int(os.getenv('CHART_DPI', '100'))
+CHART_RETENTION_SECONDS = int(os.getenv('CHART_RETENTION_SECONDS', '86400'))  # charts older than this are deleted
+CHART_DIR_MAX_MB = int(os.getenv('CHART_DIR_MAX_MB', '500'))                  # oldest charts go first above this
+
 # Static Configuration (Fallback if DB is not used for channels)
 # You can list channel IDs here as integers
 MONITORED_CHANNEL_IDS = [
     # -100123456789,
 ]
 
-# Ensure directories exist
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
-os.makedirs(CHART_DIR, exist_ok=True)
+def ensure_data_dirs():
+    """Creates the storage directories. Called at startup rather than on import."""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    os.makedirs(CHART_DIR, exist_ok=True)
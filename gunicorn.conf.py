@@ -0,0 +1,12 @@
+# Gunicorn settings for the split-process dashboard (RUN_MODE=dashboard or `gunicorn wsgi:app`)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from config import DASHBOARD_WORKERS
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = DASHBOARD_WORKERS
+threads = 2
+timeout = 30
+accesslog = '-'
@@ -8,14 +8,41 @@ if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 # -------------------------
 
+from config import RUN_MODE
+
+def exec_dashboard():
+    """Replaces this process with gunicorn; it picks up gunicorn.conf.py from BASE_DIR."""
+    os.chdir(BASE_DIR)
+    os.execvp('gunicorn', ['gunicorn', 'wsgi:app'])
+
+# The dashboard process must not import the Telegram modules below: they build the
+# clients and open the session files the orchestrator process uses
+if __name__ == "__main__" and RUN_MODE == 'dashboard':
+    exec_dashboard()
+
+import time
 import asyncio
 import threading
 import logging
-from telethon import errors
-from modules.listener import GradeListener
-from modules.notifier import bot
-from modules.dashboard import app
-from config import BOT_TOKEN
+
+# Chart and ingest workers start by importing this file again as __mp_main__; they must
+# not build the Telegram clients either, so the services are only loaded here
+if __name__ != "__mp_main__":
+    _import_start = time.perf_counter()
+
+    from telethon import errors
+    from modules.listener import GradeListener
+    from modules.notifier import pool
+    from modules.dashboard import app
+    from modules.directory import directory
+    from modules.jobs import job_queue
+    from modules.database import db, adb
+    from modules import analytics
+    from modules.ipc import start_control_server
+    from config import ANALYTICS_WARMUP, ensure_data_dirs
+
+    # Seconds per startup phase, logged once the bot is up
+    startup_timings = {'core imports': time.perf_counter() - _import_start}
 
 # Configure logging
 logging.basicConfig(
@@ -25,6 +52,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger("TelegramOrchestrator")
 
+def log_startup_report():
+    total = sum(startup_timings.values())
+    breakdown = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items())
+    logger.info(f"Startup timing: {total:.2f}s ({breakdown}). "
+                f"Run with 'python -X importtime main.py' for a per-module import breakdown.")
+
 def run_flask():
     """Runs the full Flask Admin Dashboard."""
     port = int(os.environ.get("PORT", 8080))
@@ -45,18 +78,34 @@ async def start_services():
     try:
         tasks = []
         
+        # With the SQLite backend, seed it from Supabase if empty and start write-behind sync
+        await adb.run(db.start_replication, timeout=300)
+
+        # Load registered students once; later registrations arrive incrementally
+        phase_start = time.perf_counter()
+        await adb.run(directory.load)
+        startup_timings['student directory'] = time.perf_counter() - phase_start
+        tasks.append(asyncio.create_task(directory.run_refresh()))
+        
         # Add Userbot task
         logger.info("Starting Userbot Listener...")
         tasks.append(asyncio.create_task(listener.start()))
         
-        # Add Notifier Bot task if initialized
-        if bot:
-            logger.info("Starting Notifier Bot...")
-            # Start the bot client with the token inside the running loop
-            await bot.start(bot_token=BOT_TOKEN)
-            tasks.append(asyncio.create_task(bot.run_until_disconnected()))
+        # Add Notifier Bot tasks if initialized
+        if pool:
+            logger.info(f"Starting {len(pool.shards)} Notifier Bots...")
+            # Log every bot in concurrently inside the running loop
+            phase_start = time.perf_counter()
+            await pool.start()
+            startup_timings['bot login'] = time.perf_counter() - phase_start
+            tasks.extend(asyncio.create_task(run) for run in pool.run_until_disconnected())
         else:
-            logger.error("Notifier Bot instance is None. Check API_ID/API_HASH.")
+            logger.error("Notifier Bot pool is None. Check API_ID/API_HASH/TELEGRAM_BOT_TOKEN.")
+        log_startup_report()
+
+        # Heavy analytics imports happen only now that the clients are up
+        if ANALYTICS_WARMUP == 'background':
+            asyncio.create_task(analytics.warm_up())
         
         # Run both concurrently in the same loop
         logger.info("Launching all Telegram services...")
@@ -74,13 +123,26 @@ async def start_services():
         logger.info("Disconnecting clients...")
         if listener and listener.client:
             await listener.client.disconnect()
-        if bot:
-            await bot.disconnect()
+        await job_queue.stop()
+        if pool:
+            await pool.stop()
+        analytics.shutdown()
+        adb.shutdown()
+        db.stop_replication()
 
 def main():
-    # 1. Start the full Flask dashboard in a separate thread
-    flask_thread = threading.Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    if RUN_MODE == 'dashboard':
+        exec_dashboard()
+
+    ensure_data_dirs()
+
+    # 1. Start the dashboard in a thread (single-process mode), or only the control channel
+    #    the separately deployed dashboard talks to
+    if RUN_MODE == 'telegram':
+        start_control_server()
+    else:
+        flask_thread = threading.Thread(target=run_flask, daemon=True)
+        flask_thread.start()
 
     # 2. Run the main asyncio event loop for Telegram services
     try:
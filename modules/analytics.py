@@ -0,0 +1,51 @@
+import sys
+import time
+import asyncio
+import importlib
+import logging
+import threading
+
+logger = logging.getLogger("Analytics")
+
+# Imported in this order so each timing is the incremental cost of that package
+ANALYTICS_MODULES = ('numpy', 'pandas', 'scipy.stats', 'matplotlib.figure', 'modules.engine')
+
+# module name -> seconds spent importing it (only those this process actually loaded)
+load_times = {}
+
+# Concurrent first loads (warm-up plus job workers) must not see half-imported modules
+_load_lock = threading.Lock()
+
+def load():
+    """Imports the heavy analytics stack once and returns `modules.engine`.
+
+    Nothing at startup imports pandas, numpy, matplotlib or scipy; they are loaded
+    here, either by the background warm-up or by the first file that needs them.
+    """
+    with _load_lock:
+        for name in ANALYTICS_MODULES:
+            if name not in sys.modules:
+                start = time.perf_counter()
+                importlib.import_module(name)
+                load_times[name] = time.perf_counter() - start
+    return sys.modules['modules.engine']
+
+async def warm_up():
+    """Loads the analytics stack off the event loop and logs where the time went."""
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(load)
+    except Exception as e:
+        logger.error(f"Analytics warm-up failed: {e}")
+        return
+    breakdown = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in load_times.items())
+    logger.info(f"Analytics stack ready in {time.perf_counter() - start:.2f}s ({breakdown or 'already loaded'})")
+
+def shutdown():
+    """Stops worker pools, but only for the parts of the stack that were loaded."""
+    charts = sys.modules.get('modules.charts')
+    if charts is not None:
+        charts.renderer.shutdown()
+    ingest = sys.modules.get('modules.ingest')
+    if ingest is not None:
+        ingest.shutdown_pool()
@@ -0,0 +1,153 @@
+import time
+import asyncio
+import logging
+from telethon import errors
+from telethon.tl.types import InputMessagesFilterDocument
+from config import BACKFILL_BATCH_SIZE, BACKFILL_WAIT_SECONDS
+from modules.database import adb
+from modules.downloads import download_document
+from modules.jobs import job_queue
+
+logger = logging.getLogger("Backfill")
+
+GRADE_FILE_EXTENSIONS = ('.pdf', '.xlsx', '.csv')
+
+class Backfiller:
+    """Walks channel history oldest-first and feeds earlier grade files into the job queue.
+
+    Documents are handled in batches of `batch_size`: the batch is downloaded and
+    queued in parallel, and once every job in it has finished the id of its last
+    message is checkpointed per channel. The checkpoint stops before the first file
+    whose job failed, so a later run retries it. An interrupted run resumes after the
+    last checkpoint; anything re-read from a half-finished batch is skipped by the
+    processed-file registry. History pages are fetched `wait_time` seconds apart and
+    long FloodWaits are slept out before resuming.
+    """
+
+    def __init__(self, batch_size=BACKFILL_BATCH_SIZE, wait_time=BACKFILL_WAIT_SECONDS):
+        self.batch_size = max(1, int(batch_size))
+        self.wait_time = wait_time
+        self.client = None
+        self._loop = None
+        self._task = None
+        self.state = {'status': 'idle', 'channels': {}, 'started_at': None, 'finished_at': None, 'error': None}
+
+    def attach(self, client):
+        """Uses `client` (the userbot) for history requests; call from its event loop."""
+        self.client = client
+        self._loop = asyncio.get_running_loop()
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def status(self):
+        return {**self.state, 'channels': {str(k): dict(v) for k, v in self.state['channels'].items()}}
+
+    def request(self, channel_ids=None, notify=True):
+        """Starts a backfill from another thread (the dashboard). Returns False if one cannot start now."""
+        if self._loop is None or self._loop.is_closed() or self.running:
+            return False
+        self._loop.call_soon_threadsafe(self._start, channel_ids, notify)
+        return True
+
+    def _start(self, channel_ids, notify):
+        if not self.running:
+            self._task = asyncio.ensure_future(self.run(channel_ids, notify=notify))
+
+    async def run(self, channel_ids=None, notify=True, limit=None, reset=False):
+        """Backfills `channel_ids` (default: every active monitored channel) one channel at a time."""
+        if self.client is None:
+            raise RuntimeError("Backfiller has no Telegram client attached")
+        self.state.update(status='running', channels={}, started_at=time.time(), finished_at=None, error=None)
+        try:
+            if channel_ids is None:
+                channels = await adb.get_monitored_channels()
+                if channels is None:
+                    raise RuntimeError("could not load monitored channels")
+                channel_ids = [int(c['channel_id']) for c in channels if c.get('is_active', True)]
+            logger.info(f"Backfilling {len(channel_ids)} channels (notify={notify}).")
+            for channel_id in channel_ids:
+                await self._run_channel(int(channel_id), notify, limit, reset)
+            self.state['status'] = 'done'
+        except asyncio.CancelledError:
+            self.state['status'] = 'cancelled'
+            raise
+        except Exception as e:
+            self.state.update(status='failed', error=str(e))
+            logger.error(f"Backfill stopped: {e}. The next run resumes from the last checkpoint.")
+        finally:
+            self.state['finished_at'] = time.time()
+        return self.status()
+
+    async def _run_channel(self, channel_id, notify, limit, reset):
+        progress = self.state['channels'].setdefault(channel_id, {
+            'last_message_id': 0, 'scanned': 0, 'queued': 0, 'skipped': 0, 'failed': [], 'status': 'running'})
+        while True:
+            try:
+                await self._walk_history(channel_id, notify, limit, reset, progress)
+                progress['status'] = 'done'
+                return
+            except errors.FloodWaitError as e:
+                # Telethon sleeps out short waits itself; longer ones pause the sweep, which then resumes
+                logger.warning(f"FloodWait of {e.seconds}s while backfilling {channel_id}; resuming afterwards.")
+                progress['status'] = 'flood_wait'
+                await asyncio.sleep(e.seconds)
+                reset = False
+            except Exception:
+                progress['status'] = 'failed'
+                raise
+
+    async def _walk_history(self, channel_id, notify, limit, reset, progress):
+        start_id = 0 if reset else await adb.get_backfill_checkpoint(channel_id)
+        progress.update(last_message_id=start_id, status='running')
+        logger.info(f"Backfilling channel {channel_id} after message {start_id}")
+
+        batch = []
+        async for message in self.client.iter_messages(channel_id, reverse=True, min_id=start_id, limit=limit,
+                                                       filter=InputMessagesFilterDocument,
+                                                       wait_time=self.wait_time):
+            progress['scanned'] += 1
+            batch.append(message)
+            if len(batch) >= self.batch_size:
+                await self._process_batch(channel_id, batch, notify, progress)
+                batch = []
+        if batch:
+            await self._process_batch(channel_id, batch, notify, progress)
+
+    async def _process_batch(self, channel_id, batch, notify, progress):
+        jobs = await asyncio.gather(*[self._queue_message(channel_id, m, notify, progress) for m in batch])
+        await asyncio.gather(*[job.wait() for job in jobs if job is not None])
+        failed = [m.id for m, job in zip(batch, jobs) if job is not None and job.status == 'failed']
+        blocked = bool(progress['failed'])
+        progress['failed'].extend(failed)
+        if failed:
+            logger.warning(f"Channel {channel_id}: messages {failed} failed; they are retried on the next run.")
+
+        # The checkpoint never passes a failed file, so the next run retries it; the files
+        # after it are registered as processed by then and are skipped cheaply
+        done = batch if not failed else batch[:[m.id for m in batch].index(failed[0])]
+        if blocked or not done:
+            return
+        last_message_id = done[-1].id
+        await adb.save_backfill_checkpoint(channel_id, last_message_id, progress['queued'])
+        progress['last_message_id'] = last_message_id
+        logger.info(f"Channel {channel_id}: checkpointed message {last_message_id} "
+                    f"({progress['queued']} queued, {progress['skipped']} skipped so far)")
+
+    async def _queue_message(self, channel_id, message, notify, progress):
+        ext = (message.file.ext or '').lower() if message.file else ''
+        if ext not in GRADE_FILE_EXTENSIONS:
+            progress['skipped'] += 1
+            return None
+        document_id = message.document.id
+        if await adb.get_processed_file(document_id=document_id):
+            progress['skipped'] += 1
+            return None
+        grade_file = await download_document(self.client, message)
+        job = await job_queue.submit(grade_file, channel_id, document_id=document_id,
+                                     size=message.file.size, notify=notify)
+        progress['queued'] += 1
+        return job
+
+backfiller = Backfiller()
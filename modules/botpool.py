@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import logging
+from modules.dispatcher import NotificationDispatcher
+
+logger = logging.getLogger("BotPool")
+
+def bot_id_from_token(token):
+    """Bot tokens start with the bot's user id ("123456:ABC..."), which stays stable across restarts."""
+    return int(str(token).split(':', 1)[0])
+
+class BotShard:
+    """One bot token with its own client session and rate-limited dispatcher."""
+
+    def __init__(self, bot_id, client, token=None, **dispatcher_options):
+        self.bot_id = int(bot_id)
+        self.client = client
+        self.token = token
+        self.username = None
+        self.dispatcher = NotificationDispatcher(client, **dispatcher_options)
+
+    def __repr__(self):
+        return f"<BotShard {self.username or self.bot_id}>"
+
+class BotPool:
+    """Spreads outbound notifications over several bots.
+
+    New students are assigned a home bot by rendezvous hashing of their Telegram id
+    over the bot ids, so the assignment survives restarts and reordering of the
+    tokens, and adding a bot moves only its share of students. Students are told to
+    register with their home bot and are always messaged from the bot they registered
+    with. The first bot is the primary: students registered before sharding have no
+    bot recorded and stay on it.
+    """
+
+    def __init__(self, shards):
+        if not shards:
+            raise ValueError("BotPool needs at least one bot")
+        self.shards = list(shards)
+        self.by_id = {shard.bot_id: shard for shard in self.shards}
+
+    @classmethod
+    def from_tokens(cls, tokens, api_id, api_hash, **dispatcher_options):
+        from telethon import TelegramClient
+        shards = []
+        for index, token in enumerate(tokens):
+            # The first bot keeps the original session file
+            session = 'bot_session' if index == 0 else f'bot_session_{index}'
+            client = TelegramClient(session, int(api_id), api_hash)
+            shards.append(BotShard(bot_id_from_token(token), client, token, **dispatcher_options))
+        return cls(shards)
+
+    @property
+    def primary(self):
+        return self.shards[0]
+
+    def home_shard(self, tg_id):
+        """The bot a Telegram user should register with."""
+        def weight(shard):
+            return hashlib.sha256(f"{shard.bot_id}:{tg_id}".encode()).digest()
+        return max(self.shards, key=weight)
+
+    def shard_for(self, user):
+        """The bot that may message `user`: the one they registered with, else the primary."""
+        bot_id = user.get('bot_id')
+        if bot_id:
+            shard = self.by_id.get(int(bot_id))
+            if shard is not None:
+                return shard
+            logger.warning(f"Bot {bot_id} for student {user.get('student_id')} is no longer in the pool; "
+                           f"using the primary bot.")
+        return self.primary
+
+    async def start(self):
+        """Logs every bot in concurrently. Bots that fail to start are logged and skipped."""
+        async def start_shard(shard):
+            await shard.client.start(bot_token=shard.token)
+            me = await shard.client.get_me()
+            shard.username = me.username
+
+        results = await asyncio.gather(*[start_shard(s) for s in self.shards], return_exceptions=True)
+        for shard, result in zip(self.shards, results):
+            if isinstance(result, Exception):
+                logger.error(f"Bot {shard.bot_id} failed to start: {result}")
+        started = [s for s in self.shards if s.username]
+        logger.info(f"{len(started)} of {len(self.shards)} notifier bots online: "
+                    f"{', '.join('@' + s.username for s in started)}")
+        return started
+
+    def run_until_disconnected(self):
+        return [shard.client.run_until_disconnected() for shard in self.shards if shard.username]
+
+    async def stop(self):
+        await asyncio.gather(*[shard.dispatcher.stop() for shard in self.shards], return_exceptions=True)
+        await asyncio.gather(*[shard.client.disconnect() for shard in self.shards], return_exceptions=True)
+
+    @property
+    def queue_depth(self):
+        return sum(shard.dispatcher.queue_depth for shard in self.shards)
+
+    def total(self, stat):
+        return sum(shard.dispatcher.stats[stat] for shard in self.shards)
+
+    @property
+    def dead_letters(self):
+        return [n for shard in self.shards for n in shard.dispatcher.dead_letters]
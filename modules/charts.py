@@ -0,0 +1,190 @@
+import os
+import asyncio
+import logging
+from collections import Counter
+from contextlib import contextmanager
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import imsave
+from scipy.stats import norm, gaussian_kde
+from config import (CHART_DIR, CHART_WORKERS, CHART_WIDTH, CHART_HEIGHT, CHART_DPI,
+                    CHART_RETENTION_SECONDS, CHART_DIR_MAX_MB)
+from modules.downloads import prune_directory
+from modules.workers import process_pool
+
+logger = logging.getLogger("ChartRenderer")
+
+# Charts rendered for jobs that have not finished sending them, with a count per path
+# since jobs can share one; prune_charts never deletes these
+_pending_charts = Counter()
+
+@contextmanager
+def holding_charts():
+    """Yields a list for `ChartRenderer.render(hold=...)`; the charts it collects are
+    kept from `prune_charts` until the block exits."""
+    held = []
+    try:
+        yield held
+    finally:
+        _pending_charts.subtract(held)
+        for path in set(held):
+            if _pending_charts[path] <= 0:
+                del _pending_charts[path]
+
+def compute_distribution(all_grades, summary=None):
+    """Computes everything the background artwork needs, once per file.
+
+    When the file's precomputed `summary` (see modules.stats) is given, its mean, std
+    and histogram are reused and only the KDE is evaluated from the raw grades.
+    The result is a dict of plain arrays so it can be shipped to worker processes cheaply.
+    """
+    grades = np.asarray(all_grades, dtype=float)
+    if summary and summary.get('count'):
+        mu, std = summary['mean'], summary['std']
+        counts = np.asarray(summary['histogram']['counts'], dtype=float)
+        edges = np.asarray(summary['histogram']['edges'], dtype=float)
+        density = counts / (counts.sum() * np.diff(edges))
+    else:
+        mu, std = norm.fit(grades)
+        density, edges = np.histogram(grades, bins='auto', density=True)
+
+    margin = (grades.max() - grades.min()) * 0.05 or 1.0
+    x = np.linspace(grades.min() - margin, grades.max() + margin, 200)
+    if std > 0 and len(grades) > 1:
+        kde = gaussian_kde(grades)(x)
+        pdf = norm.pdf(x, mu, std)
+    else:
+        # A single distinct grade has no spread to fit
+        kde = pdf = np.zeros_like(x)
+
+    return {
+        'mu': float(mu),
+        'std': float(std),
+        'density': density,
+        'edges': edges,
+        'x': x,
+        'kde': kde,
+        'pdf': pdf,
+    }
+
+def _build_figure(dist, subject, size, dpi):
+    """Draws the shared distribution artwork with the object-oriented Agg API (no pyplot state)."""
+    fig = Figure(figsize=size, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    ax.stairs(dist['density'], dist['edges'], fill=True, color='skyblue', alpha=0.6)
+    ax.plot(dist['x'], dist['kde'], color='skyblue', linewidth=1.5)
+    ax.plot(dist['x'], dist['pdf'], 'k', linewidth=2)
+    ax.set_xlim(dist['x'][0], dist['x'][-1])
+
+    ax.set_title(f"Grade Distribution - {subject}")
+    ax.set_xlabel("Grade")
+    ax.set_ylabel("Density")
+
+    # Per-student artists are animated so they stay out of the cached background
+    marker_line = ax.axvline(dist['x'][0], color='red', linestyle='--', animated=True)
+    marker_point = ax.scatter([dist['x'][0]], [0], color='red', s=100, zorder=5, animated=True)
+
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    return canvas, ax, marker_line, marker_point, background
+
+def _chart_path(chart_dir, chart_id, subject):
+    return os.path.join(chart_dir, f"{chart_id}_{subject}_chart.png")
+
+def _render_chunk(dist, students, subject, size, dpi, chart_dir=CHART_DIR):
+    """Worker entry point: renders the background once, then only overlays each chart's marker."""
+    canvas, ax, marker_line, marker_point, background = _build_figure(dist, subject, size, dpi)
+    paths = {}
+    for student_id, grade in students:
+        try:
+            canvas.restore_region(background)
+
+            y = norm.pdf(grade, dist['mu'], dist['std']) if dist['std'] > 0 else 0
+            marker_line.set_xdata([grade, grade])
+            marker_point.set_offsets([[grade, y]])
+            legend = ax.legend([marker_line], [f'Your Grade: {grade}'], loc='upper right')
+            legend.set_animated(True)
+
+            ax.draw_artist(marker_line)
+            ax.draw_artist(marker_point)
+            ax.draw_artist(legend)
+            legend.remove()
+
+            path = _chart_path(chart_dir, student_id, subject)
+            imsave(path, np.asarray(canvas.buffer_rgba()))
+            paths[student_id] = path
+        except Exception as e:
+            paths[student_id] = None
+            logger.error(f"Failed to render chart for {student_id}: {e}")
+    return paths
+
+class ChartRenderer:
+    """Renders per-student bell curves on a process pool, off the asyncio loop."""
+
+    def __init__(self, workers=CHART_WORKERS, size=(CHART_WIDTH, CHART_HEIGHT), dpi=CHART_DPI):
+        self.workers = max(1, int(workers))
+        self.size = size
+        self.dpi = dpi
+        self._pool = None
+
+    def _get_pool(self):
+        # Created lazily so importing this module never starts processes
+        if self._pool is None:
+            self._pool = process_pool(self.workers)
+        return self._pool
+
+    async def render(self, all_grades, students, subject, summary=None, hold=None):
+        """Renders charts for `students`, an iterable of (chart_id, grade).
+
+        The chart id only names the file, so callers can pass one id per distinct grade
+        and share the result between students. Returns a dict of chart_id -> chart path
+        (None where rendering failed). Paths are also appended to `hold`, a list from
+        `holding_charts`, so pruning leaves them alone until they are sent.
+        """
+        students = [(str(sid), float(grade)) for sid, grade in students]
+        if not students:
+            return {}
+
+        # Absolute, because workers do not share this process's working directory
+        chart_dir = os.path.abspath(CHART_DIR)
+        os.makedirs(chart_dir, exist_ok=True)
+        dist = compute_distribution(all_grades, summary)
+        chunk_size = -(-len(students) // self.workers)
+        chunks = [students[i:i + chunk_size] for i in range(0, len(students), chunk_size)]
+
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        results = await asyncio.gather(*[
+            loop.run_in_executor(pool, _render_chunk, dist, chunk, subject, self.size, self.dpi, chart_dir)
+            for chunk in chunks
+        ], return_exceptions=True)
+
+        paths = {}
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                logger.error(f"Chart worker failed for {len(chunk)} students: {result}")
+                paths.update({sid: None for sid, _ in chunk})
+            else:
+                paths.update(result)
+        if hold is not None:
+            rendered = [path for path in paths.values() if path]
+            _pending_charts.update(rendered)
+            hold.extend(rendered)
+        return paths
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+def prune_charts(max_age=CHART_RETENTION_SECONDS, max_bytes=CHART_DIR_MAX_MB * 1024 * 1024):
+    """Deletes charts older than `max_age`, then the oldest ones until the directory fits `max_bytes`.
+
+    Charts still held by a job (see `holding_charts`) are skipped.
+    """
+    return prune_directory(CHART_DIR, max_age, max_bytes, suffix='.png', keep=set(_pending_charts))
+
+renderer = ChartRenderer()
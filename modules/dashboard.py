@@ -1,8 +1,11 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response
 from flask_login import LoginManager, login_required, login_user, logout_user, UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
 from config import SECRET_KEY, ADMIN_PASSWORD
 from modules.database import db
+from modules.metrics import registry
+from modules.jobs import job_queue
+from modules.ipc import orchestrator
 import os
 import logging
 
@@ -13,6 +16,11 @@ app.config['SECRET_KEY'] = SECRET_KEY
 login_manager = LoginManager()
 login_manager.init_app(app)
 
+# In split-process mode, config writes made here are pushed to the Telegram orchestrator
+if orchestrator.enabled:
+    db.subscribe('channels', lambda: orchestrator.notify('channels'))
+    db.subscribe('settings', lambda: orchestrator.notify('settings'))
+
 class Admin(UserMixin):
     def __init__(self, id):
         self.id = id
@@ -41,8 +49,9 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    channels = db.get_monitored_channels()
-    return render_template('dashboard.html', channels=channels)
+    channels = db.get_monitored_channels() or []
+    summaries = db.get_grade_summaries(limit=10)
+    return render_template('dashboard.html', channels=channels, summaries=summaries)
 
 @app.route('/api/channels', methods=['GET', 'POST'])
 @login_required
@@ -59,11 +68,31 @@ def manage_channels():
             return jsonify({'status': 'success'})
         
         channels = db.get_monitored_channels()
+        if channels is None:
+            return jsonify({'status': 'error', 'message': 'Could not load channels'}), 500
         return jsonify(channels)
     except Exception as e:
         logger.error(f"API Error (channels): {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+# Channel ids are negative (-100...), which Flask's int converter rejects
+@app.route('/api/channels/<channel_id>', methods=['PATCH', 'DELETE'])
+@login_required
+def update_channel(channel_id):
+    try:
+        channel_id = int(channel_id)
+        if request.method == 'DELETE':
+            logger.info(f"API Request to remove channel: {channel_id}")
+            db.remove_channel(channel_id)
+        else:
+            data = request.get_json()
+            logger.info(f"API Request to update channel {channel_id}: {data}")
+            db.set_channel_active(channel_id, data.get('is_active', True))
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        logger.error(f"API Error (channel {channel_id}): {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/api/settings', methods=['GET', 'POST'])
 @login_required
 def manage_settings():
@@ -84,6 +113,125 @@ def manage_settings():
         logger.error(f"API Error (settings): {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
+@app.route('/api/summaries')
+@login_required
+def list_summaries():
+    try:
+        summaries = db.get_grade_summaries(
+            subject=request.args.get('subject'),
+            limit=min(int(request.args.get('limit', 50)), 500)
+        )
+        return jsonify(summaries)
+    except Exception as e:
+        logger.error(f"API Error (summaries): {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+GRADE_FIELDS = ('id', 'student_id', 'subject_name', 'grade', 'rank', 'percentile',
+                'file_source', 'file_hash', 'processed_at')
+AGGREGATE_FIELDS = ('student_id', 'result_count', 'average', 'trend', 'best_grade', 'last_grade',
+                    'last_subject', 'results', 'updated_at')
+
+def _requested_fields(allowed, required=()):
+    """Parses `?fields=a,b` against an allow-list. Returns None for all fields."""
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    fields = [f.strip() for f in raw.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys([*required, *fields]))
+
+@app.route('/api/grades')
+@login_required
+def list_grades():
+    """Grade history newest first. Filters: student_id, subject. Paging: limit, before (cursor)."""
+    try:
+        limit = max(1, min(int(request.args.get('limit', 50)), 500))
+        before = request.args.get('before')
+        fields = _requested_fields(GRADE_FIELDS, required=('id',))
+        # One extra row tells whether another page exists
+        rows = db.get_grade_history(
+            student_id=request.args.get('student_id'),
+            subject=request.args.get('subject'),
+            before_id=int(before) if before else None,
+            limit=limit + 1,
+            fields=fields
+        )
+        items = rows[:limit]
+        return jsonify({
+            'items': items,
+            'next_before': items[-1]['id'] if len(rows) > limit else None
+        })
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"API Error (grades): {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/students/<student_id>')
+@login_required
+def student_summary(student_id):
+    """Stored aggregates for one student (average, trend, count...)."""
+    try:
+        aggregate = db.get_student_aggregate(student_id, fields=_requested_fields(AGGREGATE_FIELDS))
+        if aggregate is None:
+            return jsonify({'status': 'error', 'message': 'No grades recorded for this student'}), 404
+        return jsonify(aggregate)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"API Error (student {student_id}): {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/jobs')
+@login_required
+def list_jobs():
+    if orchestrator.enabled:
+        try:
+            return jsonify(orchestrator.get_jobs())
+        except Exception as e:
+            logger.error(f"API Error (jobs): {e}")
+            return jsonify({'status': 'error', 'message': str(e)}), 502
+    return jsonify({
+        'queued': job_queue.depth,
+        'running': job_queue.running,
+        'jobs': job_queue.snapshot()
+    })
+
+@app.route('/api/backfill', methods=['GET', 'POST'])
+@login_required
+def backfill():
+    """Starts a history backfill (all active channels unless `channel_id` is given) or reports progress."""
+    from modules.backfill import backfiller
+    try:
+        if request.method == 'GET':
+            return jsonify(orchestrator.get_backfill() if orchestrator.enabled else backfiller.status())
+
+        data = request.json or {}
+        channel_ids = [int(data['channel_id'])] if data.get('channel_id') else None
+        notify = bool(data.get('notify', True))
+        if orchestrator.enabled:
+            status, body = orchestrator.start_backfill(channel_ids, notify)
+            return jsonify(body), status
+        if not backfiller.request(channel_ids, notify=notify):
+            return jsonify({'status': 'error', 'message': 'Backfill already running or listener not started'}), 409
+        return jsonify({'status': 'started'}), 202
+    except Exception as e:
+        logger.error(f"API Error (backfill): {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'ok'})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint. The pipeline lives in the orchestrator when running split."""
+    if orchestrator.enabled:
+        try:
+            return Response(orchestrator.get_metrics(), mimetype='text/plain; version=0.0.4')
+        except Exception as e:
+            logger.error(f"Could not fetch orchestrator metrics: {e}")
+            return Response(f"# orchestrator unreachable: {e}\n", status=502, mimetype='text/plain')
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,45 +1,191 @@
 from supabase import create_client, Client
-from config import SUPABASE_URL, SUPABASE_KEY
+from config import (SUPABASE_URL, SUPABASE_KEY, GRADE_BATCH_SIZE, GRADE_BATCH_RETRIES,
+                    SETTINGS_CACHE_TTL, DB_POOL_SIZE, DB_TIMEOUT, DB_BACKEND, SQLITE_PATH,
+                    DB_REPLICATE, REPLICATION_INTERVAL, REPLICATION_BATCH_SIZE)
 import logging
 import json
+from modules import metrics
+import time
+import string
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from modules.history import merge_results, summarize_results
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("DatabaseLayer")
 
+class TTLCache:
+    """Thread-safe read-through cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        # Load outside the lock; a failed load raises and caches nothing
+        value = loader()
+        with self._lock:
+            self._entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, *keys):
+        """Drops the given keys, or everything when called without arguments."""
+        with self._lock:
+            if not keys:
+                self._entries.clear()
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+class MessageTemplate:
+    """A `str.format` template parsed once and rendered many times."""
+
+    def __init__(self, text):
+        self.text = text
+        self._parts = list(string.Formatter().parse(text))
+        # Attribute/index lookups and nested specs are left to str.format
+        self._simple = all(
+            field is None or (field.isidentifier() and '{' not in (spec or ''))
+            for _, field, spec, _ in self._parts
+        )
+
+    def render(self, **values):
+        if not self._simple:
+            return self.text.format(**values)
+        out = []
+        for literal, field, spec, conversion in self._parts:
+            out.append(literal)
+            if field is None:
+                continue
+            value = values[field]
+            if conversion == 'r':
+                value = repr(value)
+            elif conversion == 'a':
+                value = ascii(value)
+            elif conversion == 's':
+                value = str(value)
+            out.append(format(value, spec or ''))
+        return ''.join(out)
+
 class Database:
-    def __init__(self):
+    """Storage API used by the whole app.
+
+    `client` is the table backend: the Supabase client (DB_BACKEND=supabase) or the
+    embedded SQLite store with the same table API (DB_BACKEND=sqlite), optionally
+    replicated to Supabase by a write-behind thread.
+    """
+
+    def __init__(self, backend=DB_BACKEND):
+        self.cache = TTLCache(SETTINGS_CACHE_TTL)
+        self._subscribers = {'channels': [], 'settings': []}
+        # Aggregates are read-modify-write; one writer at a time keeps them exact
+        self._aggregate_lock = threading.Lock()
+        self.replicator = None
+        if backend == 'sqlite':
+            self.client = self._open_sqlite()
+            return
+        self.client = self._connect_supabase()
+
+    def _connect_supabase(self):
         if not SUPABASE_URL or not SUPABASE_KEY:
             logger.warning("Supabase credentials not found in environment variables.")
-            self.supabase = None
-            return
+            return None
         try:
-            self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+            client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
             logger.info("Successfully connected to Supabase.")
+            return client
         except Exception as e:
             logger.error(f"Failed to connect to Supabase: {e}")
-            self.supabase = None
+            return None
+
+    def _open_sqlite(self):
+        from modules.sqlite_store import SQLiteClient, WriteBehindReplicator
+        remote = None
+        if DB_REPLICATE and SUPABASE_URL and SUPABASE_KEY:
+            remote = self._connect_supabase()
+        else:
+            logger.info("SQLite backend running without Supabase replication.")
+        try:
+            client = SQLiteClient(SQLITE_PATH, outbox=remote is not None)
+        except Exception as e:
+            logger.error(f"Failed to open SQLite store {SQLITE_PATH}: {e}")
+            return None
+        if remote is not None:
+            self.replicator = WriteBehindReplicator(client, remote, interval=REPLICATION_INTERVAL,
+                                                    batch_size=REPLICATION_BATCH_SIZE)
+        return client
+
+    def start_replication(self):
+        """Seeds an empty local store from Supabase, then starts write-behind sync.
+
+        Only the orchestrator calls this, so dashboard workers never replay the outbox twice.
+        """
+        if self.replicator is None:
+            return
+        try:
+            self.replicator.bootstrap()
+        except Exception as e:
+            logger.error(f"Could not bootstrap the local store from Supabase: {e}")
+        self.replicator.start()
+
+    def stop_replication(self):
+        if self.replicator is not None:
+            self.replicator.stop(flush=True)
 
     def get_user_by_student_id(self, student_id):
-        if not self.supabase: return None
+        if not self.client: return None
         try:
-            response = self.supabase.table('users').select('*').eq('student_id', str(student_id)).execute()
+            response = self.client.table('users').select('*').eq('student_id', str(student_id)).execute()
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Error fetching user {student_id}: {e}")
             return None
 
     def get_all_users(self):
-        if not self.supabase: return []
+        if not self.client: return []
         try:
-            response = self.supabase.table('users').select('*').execute()
+            response = self.client.table('users').select('*').execute()
             return response.data
         except Exception as e:
             logger.error(f"Error fetching all users: {e}")
             return []
 
+    def upsert_user(self, user):
+        if not self.client: return None
+        try:
+            return self.client.table('users').upsert(user, on_conflict='student_id').execute()
+        except Exception as e:
+            logger.error(f"Error upserting user {user.get('student_id')}: {e}")
+            return None
+
+    def get_users_since(self, created_at):
+        if not self.client: return []
+        try:
+            response = self.client.table('users').select('*').gt('created_at', created_at).order('created_at').execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"Error fetching users created since {created_at}: {e}")
+            return []
+
     def add_grade(self, student_id, subject, grade, rank, percentile, source):
-        if not self.supabase: return None
+        if not self.client: return None
         data = {
             'student_id': str(student_id),
             'subject_name': str(subject),
@@ -49,44 +195,302 @@ class Database:
             'file_source': str(source)
         }
         try:
-            logger.info(f"DEBUG: Sending grade payload: {json.dumps(data)}")
-            return self.supabase.table('grades').insert(data).execute()
+            logger.debug(f"Sending grade payload: {json.dumps(data)}")
+            return self.client.table('grades').insert(data).execute()
         except Exception as e:
             logger.error(f"Error adding grade for {student_id}: {e}")
             return None
 
+    def add_grades_bulk(self, matches, subject, source, file_hash=None,
+                        batch_size=GRADE_BATCH_SIZE, retries=GRADE_BATCH_RETRIES):
+        """Writes a matched frame (student_id, grade, rank, percentile) in chunked multi-row upserts.
+
+        Rows are keyed on (student_id, subject_name, file_hash), so writing the same
+        file twice updates the existing rows instead of duplicating them.
+        Each chunk is retried up to `retries` times with exponential backoff.
+        Returns the list of student_ids whose chunk could not be written; callers must
+        not record those students as delivered (the engine reports the file as 'partial').
+        """
+        rows = [
+            {
+                'student_id': str(row.student_id),
+                'subject_name': str(subject),
+                'grade': float(row.grade),
+                'rank': int(row.rank),
+                'percentile': float(row.percentile),
+                'file_source': str(source),
+                'file_hash': file_hash
+            }
+            for row in matches.itertuples(index=False)
+        ]
+        if not self.client:
+            return [r['student_id'] for r in rows]
+
+        failed = []
+        batch_size = max(1, int(batch_size))
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            for attempt in range(1, retries + 1):
+                try:
+                    self.client.table('grades').upsert(
+                        chunk, on_conflict='student_id,subject_name,file_hash'
+                    ).execute()
+                    break
+                except Exception as e:
+                    logger.warning(f"Grade batch {start // batch_size} failed (attempt {attempt}/{retries}): {e}")
+                    if attempt < retries:
+                        time.sleep(0.5 * 2 ** (attempt - 1))
+            else:
+                failed.extend(r['student_id'] for r in chunk)
+
+        logger.info(f"Stored {len(rows) - len(failed)}/{len(rows)} grades for {subject} in "
+                    f"{-(-len(rows) // batch_size)} batches")
+        if failed:
+            logger.error(f"Failed to store grades for {len(failed)} students: {failed}")
+        failed_ids = set(failed)
+        self.update_student_aggregates([r for r in rows if r['student_id'] not in failed_ids], batch_size)
+        return failed
+
+    def update_student_aggregates(self, rows, batch_size=GRADE_BATCH_SIZE):
+        """Folds freshly written grade rows into each student's aggregate row.
+
+        Costs one read and one upsert per `batch_size` students, however large the
+        grades table grows. Re-applying the same rows leaves the aggregates unchanged.
+        """
+        if not self.client or not rows: return
+        by_student = {}
+        for row in rows:
+            by_student.setdefault(row['student_id'], []).append((row['subject_name'], row['grade']))
+        student_ids = list(by_student)
+        now = datetime.now(timezone.utc).isoformat()
+        with self._aggregate_lock:
+            for start in range(0, len(student_ids), max(1, int(batch_size))):
+                chunk = student_ids[start:start + max(1, int(batch_size))]
+                try:
+                    stored = self.client.table('student_aggregates').select('student_id,results') \
+                        .in_('student_id', chunk).execute().data
+                    previous = {a['student_id']: a['results'] for a in stored}
+                    updates = []
+                    for student_id in chunk:
+                        results = merge_results(previous.get(student_id) or [], by_student[student_id])
+                        updates.append({'student_id': student_id, 'results': results,
+                                        **summarize_results(results), 'updated_at': now})
+                    self.client.table('student_aggregates').upsert(updates, on_conflict='student_id').execute()
+                except Exception as e:
+                    logger.error(f"Error updating aggregates for {len(chunk)} students: {e}")
+
+    def get_student_aggregate(self, student_id, fields=None):
+        if not self.client: return None
+        try:
+            response = self.client.table('student_aggregates').select(','.join(fields or ['*'])) \
+                .eq('student_id', str(student_id)).limit(1).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error fetching aggregate for {student_id}: {e}")
+            return None
+
+    def get_grade_history(self, student_id=None, subject=None, before_id=None, limit=50, fields=None):
+        """Grades newest first, filtered by student and/or subject.
+
+        Keyset pagination: pass the smallest `id` of a page as `before_id` to fetch the
+        next one, so each page is an index range scan however deep it is. `fields`
+        limits the returned columns.
+        """
+        if not self.client: return []
+        try:
+            query = self.client.table('grades').select(','.join(fields or ['*']))
+            if student_id is not None:
+                query = query.eq('student_id', str(student_id))
+            if subject:
+                query = query.eq('subject_name', str(subject))
+            if before_id is not None:
+                query = query.lt('id', int(before_id))
+            return query.order('id', desc=True).limit(int(limit)).execute().data
+        except Exception as e:
+            logger.error(f"Error fetching grade history (student {student_id}, subject {subject}): {e}")
+            return []
+
+    def get_latest_grades(self, student_id, subject=None, limit=10, fields=None, page_size=50, max_pages=10):
+        """A student's current grade per subject, most recent subject first.
+
+        A corrected sheet adds a new row for the subject, so older rows of a subject
+        are superseded and skipped. Walks the history by keyset pages until `limit`
+        subjects are found (at most `max_pages` pages).
+        """
+        fields = list(dict.fromkeys(['id', 'subject_name', *(fields or [])])) if fields else None
+        latest, before_id = {}, None
+        for _ in range(max_pages):
+            rows = self.get_grade_history(student_id=student_id, subject=subject, before_id=before_id,
+                                          limit=page_size, fields=fields)
+            for row in rows:
+                latest.setdefault(row['subject_name'], row)
+                if len(latest) >= limit:
+                    return list(latest.values())
+            if len(rows) < page_size:
+                break
+            before_id = rows[-1]['id']
+        return list(latest.values())
+
+    def get_processed_file(self, file_hash=None, document_id=None):
+        """Looks up the processed-file registry by content hash or Telegram document id."""
+        if not self.client: return None
+        try:
+            query = self.client.table('processed_files').select('*')
+            if file_hash is not None:
+                query = query.eq('file_hash', str(file_hash))
+            elif document_id is not None:
+                query = query.eq('document_id', int(document_id))
+            else:
+                return None
+            response = query.limit(1).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error fetching processed file {file_hash or document_id}: {e}")
+            return None
+
+    def mark_file_processed(self, file_hash, document_id, file_name, source, match_count):
+        if not self.client: return None
+        data = {
+            'file_hash': str(file_hash),
+            'document_id': int(document_id) if document_id is not None else None,
+            'file_name': str(file_name),
+            'file_source': str(source),
+            'match_count': int(match_count)
+        }
+        try:
+            return self.client.table('processed_files').upsert(data, on_conflict='file_hash').execute()
+        except Exception as e:
+            logger.error(f"Error recording processed file {file_hash}: {e}")
+            return None
+
+    def get_backfill_checkpoint(self, channel_id):
+        """Returns the id of the last message a backfill finished for `channel_id` (0 if none)."""
+        if not self.client: return 0
+        try:
+            response = self.client.table('backfill_checkpoints').select('last_message_id') \
+                .eq('channel_id', int(channel_id)).limit(1).execute()
+            return int(response.data[0]['last_message_id']) if response.data else 0
+        except Exception as e:
+            logger.error(f"Error fetching backfill checkpoint for {channel_id}: {e}")
+            return 0
+
+    def save_backfill_checkpoint(self, channel_id, last_message_id, files_queued):
+        if not self.client: return None
+        data = {
+            'channel_id': int(channel_id),
+            'last_message_id': int(last_message_id),
+            'files_queued': int(files_queued),
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        try:
+            return self.client.table('backfill_checkpoints').upsert(data, on_conflict='channel_id').execute()
+        except Exception as e:
+            logger.error(f"Error saving backfill checkpoint for {channel_id}: {e}")
+            return None
+
+    def get_subject_snapshot(self, subject):
+        """Returns the last results sent for `subject` as {'file_hash', 'snapshot'}, or None."""
+        if not self.client: return None
+        try:
+            response = self.client.table('subject_snapshots').select('file_hash,snapshot') \
+                .eq('subject_name', str(subject)).limit(1).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Error fetching snapshot for {subject}: {e}")
+            return None
+
+    def save_subject_snapshot(self, subject, file_hash, snapshot):
+        if not self.client: return None
+        data = {
+            'subject_name': str(subject),
+            'file_hash': str(file_hash),
+            'snapshot': snapshot,
+            'updated_at': datetime.now(timezone.utc).isoformat()
+        }
+        try:
+            return self.client.table('subject_snapshots').upsert(data, on_conflict='subject_name').execute()
+        except Exception as e:
+            logger.error(f"Error saving snapshot for {subject}: {e}")
+            return None
+
+    def save_grade_summary(self, subject, file_hash, source, summary):
+        if not self.client: return None
+        data = {
+            'subject_name': str(subject),
+            'file_hash': str(file_hash),
+            'file_source': str(source),
+            'student_count': int(summary.get('count', 0)),
+            'mean': summary.get('mean'),
+            'std': summary.get('std'),
+            'median': summary.get('median'),
+            'min_grade': summary.get('min'),
+            'max_grade': summary.get('max'),
+            'quantiles': summary.get('quantiles'),
+            'histogram': summary.get('histogram'),
+            'withdrawals': int(summary.get('withdrawals', 0)),
+            'invalid_rows': int(summary.get('invalid', 0))
+        }
+        try:
+            return self.client.table('grade_summaries').upsert(data, on_conflict='subject_name,file_hash').execute()
+        except Exception as e:
+            logger.error(f"Error saving summary for {subject}: {e}")
+            return None
+
+    def get_grade_summaries(self, subject=None, limit=50):
+        if not self.client: return []
+        try:
+            query = self.client.table('grade_summaries').select('*')
+            if subject:
+                query = query.eq('subject_name', str(subject))
+            response = query.order('created_at', desc=True).limit(int(limit)).execute()
+            return response.data
+        except Exception as e:
+            logger.error(f"Error fetching grade summaries: {e}")
+            return []
+
     def get_monitored_channels(self):
-        if not self.supabase: return []
+        """All channel rows, or None when they could not be fetched (unlike [] for no channels)."""
+        if not self.client: return []
         try:
             # Table name is 'channels' (plural)
-            response = self.supabase.table('channels').select('*').execute()
-            return response.data
+            return self.cache.get(('channels',), lambda: self.client.table('channels').select('*').execute().data)
         except Exception as e:
             logger.error(f"Error fetching monitored channels: {e}")
-            return []
+            return None
+
+    def _fetch_setting(self, key):
+        response = self.client.table('settings').select('value').eq('key', str(key)).execute()
+        return response.data[0]['value'] if response.data else None
 
     def get_setting(self, key):
-        if not self.supabase: return None
+        if not self.client: return None
         try:
-            response = self.supabase.table('settings').select('value').eq('key', str(key)).execute()
-            return response.data[0]['value'] if response.data else None
+            return self.cache.get(('setting', str(key)), lambda: self._fetch_setting(key))
         except Exception as e:
             logger.error(f"Error fetching setting {key}: {e}")
             return None
 
+    def get_message_template(self, key, default):
+        """Returns the setting `key` (or `default`) as a pre-compiled MessageTemplate."""
+        text = self.get_setting(key) or default
+        return self.cache.get(('template', text), lambda: MessageTemplate(text))
+
     def update_setting(self, key, value):
-        if not self.supabase: return None
+        if not self.client: return None
         data = {'key': str(key), 'value': str(value)}
         try:
             logger.info(f"DEBUG: Sending settings payload: {json.dumps(data)}")
             # Using upsert to handle both new and existing settings
-            return self.supabase.table('settings').upsert(data).execute()
+            response = self.client.table('settings').upsert(data).execute()
+            self.cache.invalidate(('setting', str(key)))
+            self._notify('settings')
+            return response
         except Exception as e:
             logger.error(f"Error updating setting {key}: {e}")
             return None
 
     def add_channel(self, channel_id, channel_name, channel_link):
-        if not self.supabase: return None
+        if not self.client: return None
         data = {
             'channel_id': int(channel_id), # schema.sql says BIGINT
             'channel_name': str(channel_name),
@@ -95,9 +499,100 @@ class Database:
         }
         try:
             logger.info(f"DEBUG: Sending channel payload: {json.dumps(data)}")
-            return self.supabase.table('channels').insert(data).execute()
+            response = self.client.table('channels').insert(data).execute()
+            self.invalidate('channels')
+            return response
         except Exception as e:
             logger.error(f"Error adding channel {channel_id}: {e}")
             return None
 
+    def set_channel_active(self, channel_id, is_active):
+        if not self.client: return None
+        try:
+            response = self.client.table('channels').update({'is_active': bool(is_active)}).eq('channel_id', int(channel_id)).execute()
+            self.invalidate('channels')
+            return response
+        except Exception as e:
+            logger.error(f"Error updating channel {channel_id}: {e}")
+            return None
+
+    def remove_channel(self, channel_id):
+        if not self.client: return None
+        try:
+            response = self.client.table('channels').delete().eq('channel_id', int(channel_id)).execute()
+            self.invalidate('channels')
+            return response
+        except Exception as e:
+            logger.error(f"Error removing channel {channel_id}: {e}")
+            return None
+
+    def subscribe(self, topic, callback):
+        """Registers `callback()` to run after `topic` ('channels' or 'settings') changes."""
+        self._subscribers[topic].append(callback)
+
+    def invalidate(self, topic):
+        """Drops cached rows for `topic` and tells subscribers. Also used for changes made by other processes."""
+        if topic == 'channels':
+            self.cache.invalidate(('channels',))
+        else:
+            self.cache.invalidate()
+        self._notify(topic)
+
+    def _notify(self, topic):
+        for callback in list(self._subscribers.get(topic, [])):
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"{topic} change subscriber failed: {e}")
+
+class AsyncDatabase:
+    """Awaitable view of a Database for use inside the asyncio loop.
+
+    Every public `Database` method is available as a coroutine of the same name that
+    runs on a dedicated thread pool, so blocking backend calls (Supabase HTTP requests
+    on a keep-alive connection pool, or SQLite queries) overlap with Telegram I/O. Pass
+    `timeout=` to override DB_TIMEOUT for a single call.
+    """
+
+    def __init__(self, database, pool_size=DB_POOL_SIZE, timeout=DB_TIMEOUT):
+        self.database = database
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='db')
+
+    async def run(self, func, *args, timeout=None, **kwargs):
+        """Runs any blocking callable on the DB thread pool and awaits it with a timeout."""
+        name = getattr(func, '__name__', str(func))
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+        try:
+            with metrics.DB_CALL_SECONDS.time(method=name):
+                return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # The worker thread keeps running; the caller just stops waiting for it
+            metrics.DB_ERRORS_TOTAL.inc(method=name)
+            logger.error(f"Database call {name} timed out after {timeout or self.timeout}s")
+            raise
+        except Exception:
+            metrics.DB_ERRORS_TOTAL.inc(method=name)
+            raise
+
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        if name.startswith('_') or not callable(method):
+            return method
+
+        async def call(*args, timeout=None, **kwargs):
+            return await self.run(method, *args, timeout=timeout, **kwargs)
+        call.__name__ = name
+        return call
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
 db = Database()
+adb = AsyncDatabase(db)
+
+metrics.gauge('grades_settings_cache_hits', 'Settings/channel cache hits.', lambda: db.cache.hits)
+metrics.gauge('grades_settings_cache_misses', 'Settings/channel cache misses.', lambda: db.cache.misses)
+metrics.gauge('grades_replication_backlog', 'Local writes waiting to be replicated to Supabase.',
+              lambda: db.replicator.backlog if db.replicator else 0)
@@ -0,0 +1,98 @@
+import re
+import asyncio
+import logging
+from config import DIRECTORY_REFRESH_INTERVAL
+from modules.database import db, adb
+
+logger = logging.getLogger("StudentDirectory")
+
+def normalize_student_id(value):
+    """Scalar twin of engine.normalize_student_ids: drops whitespace, "123.0" suffixes and leading zeros."""
+    key = re.sub(r'\.0+$', '', str(value).strip()).lstrip('0')
+    return key or '0'
+
+class StudentDirectory:
+    """In-memory map of registered students keyed by normalized student_id.
+
+    Loaded once from the `users` table, then kept current by polling `created_at`
+    deltas and by `upsert` calls from the bot's registration handler.
+    """
+
+    def __init__(self, refresh_interval=DIRECTORY_REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        self._users = {}
+        self._by_tg_id = {}
+        self._last_created_at = None
+        self.loaded = False
+
+    def __len__(self):
+        return len(self._users)
+
+    def _add(self, user):
+        if user.get('student_id') is None or user.get('tg_id') is None:
+            return
+        entry = {
+            'student_id': str(user['student_id']),
+            'tg_id': str(user['tg_id']),
+            'full_name': user.get('full_name'),
+            'bot_id': user.get('bot_id'),
+        }
+        key = normalize_student_id(user['student_id'])
+        previous = self._users.get(key)
+        # A student re-registering from another Telegram account must not stay reachable by the old one
+        if previous is not None and self._by_tg_id.get(previous['tg_id']) is previous:
+            del self._by_tg_id[previous['tg_id']]
+        self._users[key] = entry
+        self._by_tg_id[entry['tg_id']] = entry
+        created_at = user.get('created_at')
+        if created_at and (self._last_created_at is None or created_at > self._last_created_at):
+            self._last_created_at = created_at
+
+    def load(self):
+        """Replaces the directory with a full copy of the users table."""
+        users = db.get_all_users()
+        self._users = {}
+        self._by_tg_id = {}
+        self._last_created_at = None
+        for user in users:
+            self._add(user)
+        self.loaded = True
+        logger.info(f"Loaded {len(self._users)} registered students.")
+
+    def refresh(self):
+        """Pulls only users created since the newest one already known."""
+        if not self.loaded or self._last_created_at is None:
+            return self.load()
+        users = db.get_users_since(self._last_created_at)
+        for user in users:
+            self._add(user)
+        if users:
+            logger.info(f"Added {len(users)} newly registered students.")
+
+    def ensure_loaded(self):
+        if not self.loaded:
+            self.load()
+
+    def upsert(self, user):
+        """Applies a registration locally so it is visible without a refresh."""
+        self._add(user)
+
+    def get(self, student_id):
+        return self._users.get(normalize_student_id(student_id))
+
+    def get_by_tg_id(self, tg_id):
+        return self._by_tg_id.get(str(tg_id))
+
+    def users(self):
+        return list(self._users.values())
+
+    async def run_refresh(self):
+        """Background task that polls for new registrations every `refresh_interval` seconds."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await adb.run(self.refresh)
+            except Exception as e:
+                logger.error(f"Student directory refresh failed: {e}")
+
+directory = StudentDirectory()
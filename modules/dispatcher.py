@@ -0,0 +1,298 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from telethon import errors
+from config import (NOTIFY_WORKERS, NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_RATE,
+                    NOTIFY_MAX_RETRIES, NOTIFY_QUEUE_SIZE, MEDIA_CACHE_SIZE,
+                    NOTIFY_CHAT_BUCKETS, NOTIFY_DEAD_LETTERS)
+from modules.metrics import SEND_SECONDS
+
+logger = logging.getLogger("NotificationDispatcher")
+
+# Telegram rejects longer captions on media messages and larger albums
+CAPTION_LIMIT = 1024
+ALBUM_LIMIT = 10
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursting up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def is_idle(self):
+        """True when nobody is waiting on the bucket and it has refilled, so a fresh one is equivalent."""
+        refilled = self.tokens + (time.monotonic() - self.updated) * self.rate
+        return not self._lock.locked() and refilled >= self.capacity
+
+class Notification:
+    def __init__(self, chat_id, message, file=None, media_key=None):
+        self.chat_id = chat_id
+        self.message = message
+        self.file = file
+        self.media_key = media_key
+        self.attempts = 0
+        self.parts_sent = 0
+        self.error = None
+        self.future = asyncio.get_running_loop().create_future()
+
+class NotificationDispatcher:
+    """Queues outgoing messages and sends them with bounded concurrency.
+
+    Sends are limited by a global token bucket and a per-chat bucket (Telegram allows
+    roughly 30 messages/s per bot and 1 message/s per chat). A FloodWaitError pauses
+    every worker until it expires; other errors are retried and finally moved to
+    `dead_letters`, which keeps only the most recent `dead_letter_limit` failures.
+    Per-chat buckets are dropped least recently used first once more than
+    `chat_bucket_limit` exist, but only after they have refilled.
+
+    Attachments sent with a `media_key` are uploaded once; later sends with the same
+    key reuse the Telegram media returned by the first one. `file` may also be a list
+    of attachments (with a matching list of keys), which is sent as one album.
+    """
+
+    def __init__(self, client, workers=NOTIFY_WORKERS, global_rate=NOTIFY_GLOBAL_RATE,
+                 per_chat_rate=NOTIFY_PER_CHAT_RATE, max_retries=NOTIFY_MAX_RETRIES,
+                 queue_size=NOTIFY_QUEUE_SIZE, media_cache_size=MEDIA_CACHE_SIZE,
+                 chat_bucket_limit=NOTIFY_CHAT_BUCKETS, dead_letter_limit=NOTIFY_DEAD_LETTERS):
+        self.client = client
+        self.workers = max(1, int(workers))
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max(1, int(max_retries))
+        self.queue_size = queue_size
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets = OrderedDict()
+        self.chat_bucket_limit = chat_bucket_limit
+        self.dead_letters = deque(maxlen=dead_letter_limit)
+        self.media_cache = OrderedDict()
+        self.media_cache_size = media_cache_size
+        self._upload_locks = {}
+        self.stats = {'sent': 0, 'failed': 0, 'retried': 0, 'flood_waits': 0, 'flood_wait_seconds': 0,
+                      'uploads': 0, 'media_reuses': 0}
+        self._queue = None
+        self._tasks = []
+        self._resume_at = 0.0
+
+    def _ensure_started(self):
+        # Workers are bound to the loop that first submits a message
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+            logger.info(f"Started {self.workers} notification workers.")
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def submit(self, chat_id, message, file=None, media_key=None):
+        """Enqueues a message (waiting while the queue is full) and returns its Notification."""
+        self._ensure_started()
+        notification = Notification(chat_id, message, file, media_key)
+        await self._queue.put(notification)
+        return notification
+
+    async def send(self, chat_id, message, file=None, media_key=None):
+        """Enqueues a message and waits until it is delivered or dead-lettered. Returns True on delivery."""
+        notification = await self.submit(chat_id, message, file, media_key)
+        return await notification.future
+
+    async def join(self):
+        """Waits until every queued message has been handled."""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _wait_for_flood_window(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+            # Dropping a bucket that is still throttling its chat would let it burst early
+            while len(self.chat_buckets) > self.chat_bucket_limit:
+                oldest_id, oldest = next(iter(self.chat_buckets.items()))
+                if not oldest.is_idle():
+                    break
+                del self.chat_buckets[oldest_id]
+        else:
+            self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def _remember_media(self, key, media):
+        self.media_cache[key] = media
+        self.media_cache.move_to_end(key)
+        while len(self.media_cache) > self.media_cache_size:
+            self.media_cache.popitem(last=False)
+
+    async def _send(self, notification):
+        """Sends one message, uploading its attachment only if no earlier send did."""
+        chat_id, message, file, key = (notification.chat_id, notification.message,
+                                       notification.file, notification.media_key)
+        if isinstance(file, (list, tuple)):
+            await self._send_album(notification)
+            return
+        if not file or not os.path.exists(file):
+            # Only reuse media that is already known; never wait on an upload without a file
+            media = self.media_cache.get(key) if key is not None else None
+            await self.client.send_message(chat_id, message, file=media)
+            return
+        if key is None:
+            await self.client.send_message(chat_id, message, file=file)
+            self.stats['uploads'] += 1
+            return
+
+        media = self.media_cache.get(key)
+        if media is None:
+            # One upload per key; concurrent sends of the same chart wait for it
+            lock = self._upload_locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                media = self.media_cache.get(key)
+                if media is None:
+                    sent = await self.client.send_message(chat_id, message, file=file)
+                    self.stats['uploads'] += 1
+                    media = getattr(sent, 'photo', None) or getattr(sent, 'document', None)
+                    if media is not None:
+                        self._remember_media(key, media)
+                    self._upload_locks.pop(key, None)
+                    return
+
+        try:
+            await self.client.send_message(chat_id, message, file=media)
+            self.media_cache.move_to_end(key)
+            self.stats['media_reuses'] += 1
+        except errors.FileReferenceExpiredError:
+            # Stale reference: upload again and cache the fresh media
+            self.media_cache.pop(key, None)
+            sent = await self.client.send_message(chat_id, message, file=file)
+            self.stats['uploads'] += 1
+            media = getattr(sent, 'photo', None) or getattr(sent, 'document', None)
+            if media is not None:
+                self._remember_media(key, media)
+
+    async def _send_album(self, notification):
+        """Sends several attachments as albums captioned with the notification's message.
+
+        Telegram allows ALBUM_LIMIT media per album, so longer lists go out in groups
+        with the caption on the first. Groups already delivered are remembered on the
+        notification and skipped when a later group is retried. Each attachment is
+        resolved on its own: cached media where its key is known, otherwise the file
+        is uploaded and its media cached for later albums.
+        """
+        chat_id, message, files = notification.chat_id, notification.message, notification.file
+        keys = notification.media_key or [None] * len(files)
+        items = [(path, key) for path, key in zip(files, keys)
+                 if (key is not None and key in self.media_cache) or (path and os.path.exists(path))]
+
+        # Parts in send order: an over-long caption goes out as its own text message first
+        parts = []
+        if not items or len(message) > CAPTION_LIMIT:
+            parts.append((message, []))
+            message = ''
+        for start in range(0, len(items), ALBUM_LIMIT):
+            parts.append((message if start == 0 else '', items[start:start + ALBUM_LIMIT]))
+
+        for index in range(notification.parts_sent, len(parts)):
+            caption, group = parts[index]
+            if group:
+                await self._send_group(chat_id, caption, group)
+            else:
+                await self.client.send_message(chat_id, caption)
+            notification.parts_sent = index + 1
+
+    async def _send_group(self, chat_id, caption, items):
+        """Sends one album of at most ALBUM_LIMIT (path, media key) items."""
+        album = [self.media_cache[key] if key is not None and key in self.media_cache else path
+                 for path, key in items]
+        try:
+            sent = await self.client.send_message(chat_id, caption, file=album)
+        except errors.FileReferenceExpiredError:
+            # Stale reference: upload every file of the album again
+            for _, key in items:
+                self.media_cache.pop(key, None)
+            items = [(path, key) for path, key in items if path and os.path.exists(path)]
+            album = [path for path, _ in items]
+            sent = await self.client.send_message(chat_id, caption, file=album or None)
+
+        sent = sent if isinstance(sent, list) else [sent]
+        for (_, key), item, msg in zip(items, album, sent):
+            if not isinstance(item, str):
+                self.media_cache.move_to_end(key)
+                self.stats['media_reuses'] += 1
+                continue
+            self.stats['uploads'] += 1
+            media = getattr(msg, 'photo', None) or getattr(msg, 'document', None)
+            if key is not None and media is not None:
+                self._remember_media(key, media)
+
+    async def _deliver(self, notification):
+        while True:
+            await self._wait_for_flood_window()
+            await self._chat_bucket(notification.chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                with SEND_SECONDS.time():
+                    await self._send(notification)
+                self.stats['sent'] += 1
+                return True
+            except errors.FloodWaitError as e:
+                # Back off globally; FloodWaits don't count against the retry budget
+                self.stats['flood_waits'] += 1
+                self.stats['flood_wait_seconds'] += e.seconds
+                self._resume_at = max(self._resume_at, time.monotonic() + e.seconds)
+                logger.warning(f"FloodWait during notification: pausing all sends for {e.seconds}s")
+            except Exception as e:
+                notification.attempts += 1
+                notification.error = e
+                if notification.attempts >= self.max_retries:
+                    self.stats['failed'] += 1
+                    self.dead_letters.append(notification)
+                    logger.error(f"Giving up on notification to {notification.chat_id} "
+                                 f"after {notification.attempts} attempts: {e}")
+                    return False
+                self.stats['retried'] += 1
+                logger.warning(f"Notification to {notification.chat_id} failed "
+                               f"(attempt {notification.attempts}/{self.max_retries}): {e}")
+                await asyncio.sleep(2 ** notification.attempts)
+
+    async def _worker(self, index):
+        while True:
+            notification = await self._queue.get()
+            try:
+                delivered = await self._deliver(notification)
+                if not notification.future.done():
+                    notification.future.set_result(delivered)
+            except asyncio.CancelledError:
+                if not notification.future.done():
+                    notification.future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Notification worker {index} crashed on {notification.chat_id}: {e}")
+                if not notification.future.done():
+                    notification.future.set_result(False)
+            finally:
+                self._queue.task_done()
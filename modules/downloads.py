@@ -0,0 +1,174 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
+from contextlib import contextmanager
+from config import (DOWNLOAD_DIR, DOWNLOAD_MEMORY_LIMIT_MB, DOWNLOAD_WORKERS,
+                    DOWNLOAD_RETENTION_SECONDS, DOWNLOAD_DIR_MAX_MB)
+
+logger = logging.getLogger("Downloads")
+
+# Telegram serves files in parts of at most 512 KiB
+PART_SIZE = 512 * 1024
+
+# Temporary downloads still owned by a job; retention never deletes these
+_active_paths = set()
+
+class GradeFile:
+    """A grade file held either in memory (`data`) or on disk (`path`).
+
+    Small files are downloaded straight into memory and parsed from there; large ones
+    are written to a temporary file that `cleanup` removes once the job is done.
+    """
+
+    def __init__(self, name, data=None, path=None, temporary=False):
+        self.name = name
+        self.data = data
+        self.path = path
+        self.temporary = temporary
+        if temporary and path:
+            _active_paths.add(path)
+
+    @classmethod
+    def from_path(cls, path):
+        return cls(os.path.basename(path), path=path)
+
+    @property
+    def source(self):
+        """What the ingestion readers accept: the raw bytes or the file path."""
+        return self.data if self.data is not None else self.path
+
+    @property
+    def size(self):
+        if self.data is not None:
+            return len(self.data)
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def sha256(self, chunk_size=1 << 20):
+        if self.data is not None:
+            return hashlib.sha256(self.data).hexdigest()
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def cleanup(self):
+        self.data = None
+        if self.temporary and self.path:
+            _active_paths.discard(self.path)
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove temporary download {self.path}: {e}")
+
+    def __repr__(self):
+        where = 'memory' if self.data is not None else self.path
+        return f"<GradeFile {self.name} ({where})>"
+
+def as_grade_file(file):
+    """Accepts a GradeFile or a plain path."""
+    return file if isinstance(file, GradeFile) else GradeFile.from_path(file)
+
+@contextmanager
+def spooled_path(source, suffix=''):
+    """Yields an absolute path for `source`: the path itself, or a temp file holding its bytes.
+
+    Lets process-pool tasks share one on-disk copy of an in-memory file instead of
+    each receiving the bytes pickled. The temp file is removed on exit.
+    """
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        yield os.path.abspath(source)
+        return
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=os.path.abspath(DOWNLOAD_DIR), suffix=suffix)
+    _active_paths.add(path)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(source)
+        yield path
+    finally:
+        _active_paths.discard(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+async def download_document(client, message, name=None, memory_limit=DOWNLOAD_MEMORY_LIMIT_MB * 1024 * 1024,
+                            workers=DOWNLOAD_WORKERS):
+    """Downloads a message's document into memory, or in parallel parts to a temp file when large."""
+    name = name or message.file.name or f"{message.document.id}{message.file.ext or ''}"
+    size = message.file.size or 0
+    if size <= memory_limit:
+        data = await client.download_media(message, file=bytes)
+        return GradeFile(name, data=data)
+
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=DOWNLOAD_DIR, suffix=os.path.splitext(name)[1])
+    try:
+        os.ftruncate(fd, size)
+        await _download_parts(client, message.document, fd, size, max(1, int(workers)))
+    except BaseException:
+        os.close(fd)
+        os.remove(path)
+        raise
+    os.close(fd)
+    logger.info(f"Downloaded {name} ({size} bytes) to {path} with {workers} parallel streams")
+    return GradeFile(name, path=path, temporary=True)
+
+async def _download_parts(client, document, fd, size, workers):
+    """Stream i fetches parts i, i + workers, i + 2 * workers, ... and writes each at its offset."""
+    parts = -(-size // PART_SIZE)
+    workers = min(workers, parts)
+
+    async def stream(index):
+        stride = workers * PART_SIZE
+        position = index * PART_SIZE
+        async for chunk in client.iter_download(document, offset=position, stride=stride,
+                                                limit=-(-(parts - index) // workers),
+                                                chunk_size=PART_SIZE, request_size=PART_SIZE,
+                                                file_size=size):
+            os.pwrite(fd, chunk, position)
+            position += stride
+
+    await asyncio.gather(*[stream(i) for i in range(workers)])
+
+def prune_directory(directory, max_age, max_bytes, suffix='', keep=()):
+    """Deletes files older than `max_age`, then the oldest ones until the directory fits `max_bytes`.
+
+    Paths in `keep` are never deleted, whether given relative or absolute.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    try:
+        entries = [e for e in os.scandir(directory)
+                   if e.is_file() and e.name.endswith(suffix) and os.path.abspath(e.path) not in keep]
+    except FileNotFoundError:
+        return 0
+    now = time.time()
+    files = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries), reverse=True)
+    removed = 0
+    total = 0
+    for mtime, size, path in files:
+        # Newest first, so whatever overflows the budget is the oldest
+        if now - mtime > max_age or total + size > max_bytes:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                logger.warning(f"Could not remove {path}: {e}")
+        else:
+            total += size
+    if removed:
+        logger.info(f"Pruned {removed} files from {directory}")
+    return removed
+
+def prune_downloads(max_age=DOWNLOAD_RETENTION_SECONDS, max_bytes=DOWNLOAD_DIR_MAX_MB * 1024 * 1024):
+    """Applies the retention policy to whatever is left in the download directory."""
+    return prune_directory(DOWNLOAD_DIR, max_age, max_bytes, keep=set(_active_paths))
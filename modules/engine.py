@@ -1,118 +1,326 @@
 import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.stats import norm
 import os
+import asyncio
 import logging
-from config import CHART_DIR
-from modules.database import db
+from contextlib import AsyncExitStack
+from config import GRADE_WRITE_TIMEOUT
+from modules.database import adb
+from modules.directory import directory
+from modules.downloads import as_grade_file
+from modules.ingest import read_grade_file, list_sheets, analyze_workbook, SUPPORTED_EXTENSIONS
+from modules.stats import analyze_grades
+from modules.charts import renderer, compute_distribution, _render_chunk, prune_charts, holding_charts
+from modules.metrics import STAGE_SECONDS, FILES_TOTAL
 
 logger = logging.getLogger("DataEngine")
 
-async def process_file(file_path, source_id):
-    logger.info(f"Starting analysis for: {file_path}")
-    
+# Hashes of files currently being processed, so simultaneous re-posts are skipped too
+_in_flight = set()
+
+# One lock per subject so two versions of a sheet never diff against the same snapshot
+_subject_locks = {}
+
+SNAPSHOT_COLUMNS = ['student_id', 'grade', 'rank', 'percentile']
+
+def hash_file(file_path, chunk_size=1 << 20):
+    """SHA-256 of the file contents, read in chunks."""
+    return as_grade_file(file_path).sha256(chunk_size)
+
+async def process_file(file, source_id, document_id=None, notify=True):
+    """Runs the full pipeline for one grade file and returns its outcome label.
+
+    `file` is a GradeFile (in memory or on disk) or a plain path. With `notify=False`
+    grades and charts are stored but no messages are sent (used by quiet backfills).
+    """
+    file = as_grade_file(file)
+    logger.info(f"Starting analysis for: {file.name}")
+
+    with STAGE_SECONDS.time(stage='total'):
+        try:
+            outcome = await _process_file(file, source_id, document_id, notify)
+        except Exception as e:
+            outcome = 'error'
+            logger.error(f"Error in data engine: {e}")
+    FILES_TOTAL.inc(outcome=outcome)
+    return outcome
+
+async def _process_file(file, source_id, document_id, notify):
+    """Runs the pipeline for one file and returns its outcome label."""
+    file_hash = None
     try:
-        # 1. Load data
-        if file_path.endswith('.xlsx'):
-            df = pd.read_excel(file_path)
-        elif file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            # PDF support would require extra libraries like tabula-py
-            logger.warning(f"PDF processing not yet implemented for {file_path}")
-            return
-
-        # Standardize column names (case-insensitive search)
-        df.columns = [c.lower().strip() for c in df.columns]
-        
-        # Look for ID and Grade columns
-        id_col = next((c for c in df.columns if 'id' in c or 'student' in c), None)
-        grade_col = next((c for c in df.columns if 'grade' in c or 'mark' in c or 'result' in c), None)
-
-        if not id_col or not grade_col:
-            logger.error(f"Could not find ID or Grade columns in {file_path}. Columns: {df.columns}")
-            return
-
-        # 2. Clean data: remove withdrawals (grade 0)
-        df[grade_col] = pd.to_numeric(df[grade_col], errors='coerce')
-        df_clean = df[df[grade_col] > 0].dropna(subset=[grade_col, id_col]).copy()
-        
+        # 0. Skip files whose exact contents were already processed
+        with STAGE_SECONDS.time(stage='hash'):
+            file_hash = await asyncio.to_thread(file.sha256)
+        if file_hash in _in_flight:
+            logger.info(f"Skipping duplicate file {file.name} (sha256 {file_hash[:12]}, already in progress)")
+            file_hash = None
+            return 'duplicate'
+        # Claimed before the registry lookup awaits, so a simultaneous re-post sees it
+        _in_flight.add(file_hash)
+        if await adb.get_processed_file(file_hash=file_hash):
+            logger.info(f"Skipping duplicate file {file.name} (sha256 {file_hash[:12]})")
+            return 'duplicate'
+
+        # 1. Load only the ID and grade columns; a workbook with several sheets holds a subject per sheet
+        if not file.name.lower().endswith(SUPPORTED_EXTENSIONS):
+            logger.warning(f"Unsupported file type: {file.name}")
+            return 'unsupported'
+
+        if file.name.lower().endswith('.xlsx'):
+            sheets = await asyncio.to_thread(list_sheets, file.source)
+            if len(sheets) > 1:
+                return await _process_workbook(file, file_hash, sheets, source_id, document_id, notify)
+
+        with STAGE_SECONDS.time(stage='parse'):
+            df = await asyncio.to_thread(read_grade_file, file.source, name=file.name)
+        if df is None:
+            return 'invalid'
+
+        # 2. Clean data (remove withdrawals), rank, and calculate class stats once
+        df_clean, summary = analyze_grades(df)
         if df_clean.empty:
-            logger.warning(f"No valid grades found in {file_path}")
-            return
-
-        # 3. Calculate class stats
-        mean = df_clean[grade_col].mean()
-        std = df_clean[grade_col].std()
-        
-        # Calculate Rank and Percentile
-        df_clean['rank'] = df_clean[grade_col].rank(ascending=False, method='min')
-        df_clean['percentile'] = df_clean[grade_col].rank(pct=True) * 100
-        
-        subject = os.path.basename(file_path).split('.')[0]
-        
-        # 4. Get all registered users from DB
-        registered_users = db.get_all_users()
+            logger.warning(f"No valid grades found in {file.name}")
+            return 'empty'
+
+        subject = os.path.basename(file.name).split('.')[0]
+        await adb.save_grade_summary(subject, file_hash, str(source_id), summary)
+
+        # 3. Get all registered users from the in-memory directory
+        registered_users = await _registered_users()
         if not registered_users:
-            logger.info("No registered users in database. Skipping notifications.")
-            return
-
-        # 5. Search for matches
-        for user in registered_users:
-            student_id = str(user['student_id'])
-            
-            # Find student in the dataframe
-            match = df_clean[df_clean[id_col].astype(str) == student_id]
-            
-            if not match.empty:
-                row = match.iloc[0]
-                grade = row[grade_col]
-                rank = int(row['rank'])
-                percentile = round(row['percentile'], 2)
-                
-                logger.info(f"Match found! Student {student_id} got {grade}")
-                
-                # Generate Chart
-                chart_path = generate_bell_curve(df_clean[grade_col], grade, student_id, subject)
-                
-                # Save to DB
-                db.add_grade(student_id, subject, grade, rank, percentile, str(source_id))
-                
-                # Notify student
-                from modules.notifier import notify_student
-                await notify_student(student_id, subject, grade, rank, percentile, chart_path)
+            return 'no_users'
 
-    except Exception as e:
-        logger.error(f"Error in data engine: {e}")
+        async with _subject_locks.setdefault(subject, asyncio.Lock()):
+            # Charts of this job stay out of reach of pruning until they have been sent
+            with holding_charts() as held:
+                matches, changed, failed = await _apply_subject(subject, df_clean, summary, registered_users,
+                                                                file_hash, file_hash[:16], source_id, held)
+
+                # 8. Hand every notification to the dispatcher; it bounds concurrency and rate
+                if notify and not changed.empty:
+                    from modules.notifier import notify_student
+                    with STAGE_SECONDS.time(stage='notify'):
+                        await asyncio.gather(*[
+                            notify_student(row.student_id, subject, row.grade, row.rank, row.percentile,
+                                           row.chart_path, media_key=(file_hash, subject, row.grade))
+                            for row in changed.itertuples(index=False)
+                        ])
+            if not changed.empty:
+                await asyncio.to_thread(prune_charts)
+
+            await adb.save_subject_snapshot(subject, file_hash, matches[SNAPSHOT_COLUMNS].to_dict(orient='list'))
+
+        if failed:
+            # Not registered as processed, so posting the file again retries the failed students
+            return 'partial'
+        await adb.mark_file_processed(file_hash, document_id, os.path.basename(file.name),
+                                      str(source_id), len(matches))
+        return 'processed' if not changed.empty else 'unchanged'
+
+    finally:
+        _in_flight.discard(file_hash)
+
+async def _process_workbook(file, file_hash, sheets, source_id, document_id, notify):
+    """Processes a workbook with one subject per sheet and returns its outcome label.
+
+    Sheets are parsed and ranked in parallel on the ingestion process pool and stored
+    concurrently, each under `workbook_subject`. Each student then gets one message covering every subject of the
+    workbook instead of one per sheet.
+    """
+    with STAGE_SECONDS.time(stage='parse'):
+        analyzed = await analyze_workbook(file.source, file.name, sheets)
+    if all(result is None for result in analyzed.values()):
+        return 'invalid'
+
+    subjects = {}
+    for index, (sheet, result) in enumerate(analyzed.items()):
+        if result is None:
+            continue
+        df_clean, summary = result
+        if df_clean.empty:
+            logger.warning(f"No valid grades found in sheet {sheet!r} of {file.name}")
+            continue
+        subjects[workbook_subject(file.name, sheet)] = (index, df_clean, summary)
+    if not subjects:
+        return 'empty'
+    logger.info(f"{file.name}: {len(subjects)} subjects from {len(sheets)} sheets")
+
+    await asyncio.gather(*[adb.save_grade_summary(subject, file_hash, str(source_id), summary)
+                           for subject, (_, _, summary) in subjects.items()])
+
+    registered_users = await _registered_users()
+    if not registered_users:
+        return 'no_users'
+
+    async with AsyncExitStack() as stack:
+        # Always locked in sorted order, so workbooks sharing subjects cannot deadlock
+        for subject in sorted(subjects):
+            await stack.enter_async_context(_subject_locks.setdefault(subject, asyncio.Lock()))
+        # Charts of this job stay out of reach of pruning until they have been sent
+        held = stack.enter_context(holding_charts())
+
+        applied = await asyncio.gather(*[
+            _apply_subject(subject, df_clean, summary, registered_users,
+                           file_hash, f"{file_hash[:16]}_{index}", source_id, held)
+            for subject, (index, df_clean, summary) in subjects.items()
+        ])
+        results = dict(zip(subjects, applied))
+        changed = [c.assign(subject=subject) for subject, (_, c, _) in results.items() if not c.empty]
+
+        # Merge the changed results per student: one combined notification per workbook
+        if notify and changed:
+            from modules.notifier import notify_student_results
+            merged = pd.concat(changed, ignore_index=True)
+            with STAGE_SECONDS.time(stage='notify'):
+                await asyncio.gather(*[
+                    notify_student_results(student_id, [
+                        {'subject': row.subject, 'grade': row.grade, 'rank': row.rank,
+                         'percentile': row.percentile, 'chart_path': row.chart_path,
+                         'media_key': (file_hash, row.subject, row.grade)}
+                        for row in rows.itertuples(index=False)
+                    ])
+                    for student_id, rows in merged.groupby('student_id', sort=False)
+                ])
+        if changed:
+            await asyncio.to_thread(prune_charts)
+
+        await asyncio.gather(*[
+            adb.save_subject_snapshot(subject, file_hash, matches[SNAPSHOT_COLUMNS].to_dict(orient='list'))
+            for subject, (matches, _, _) in results.items()
+        ])
+
+    if any(failed for _, _, failed in results.values()):
+        return 'partial'
+    await adb.mark_file_processed(file_hash, document_id, os.path.basename(file.name), str(source_id),
+                                  sum(len(matches) for matches, _, _ in results.values()))
+    return 'processed' if changed else 'unchanged'
+
+def workbook_subject(file_name, sheet):
+    """Subject name for one sheet of a workbook: "<file stem> - <sheet>".
+
+    Qualified by the workbook so that generic sheet names ("Sheet1", "Course 1") in
+    different faculties' files never share a snapshot, lock or aggregate entry.
+    """
+    stem = os.path.basename(file_name).split('.')[0]
+    return f"{stem} - {str(sheet).strip()}"
+
+async def _registered_users():
+    await adb.run(directory.ensure_loaded)
+    users = directory.users()
+    if not users:
+        logger.info("No registered users in database. Skipping notifications.")
+    return users
+
+async def _apply_subject(subject, df_clean, summary, registered_users, file_hash, chart_prefix, source_id, held):
+    """Matches, diffs, charts and stores one subject. Returns (matches, changed, failed).
+
+    `changed` holds the matched rows whose result moved since the subject's last
+    snapshot, with a `chart_path` column. Students whose grades could not be written
+    are listed in `failed` and dropped from both frames: they are not notified and,
+    missing from the snapshot, count as changed when the sheet is posted again. The
+    caller holds the subject lock, notifies and then saves the snapshot from `matches`;
+    rendered charts are added to its `held` list (see `charts.holding_charts`).
+    """
+    # 4. Join registered users against the sheet in one pass
+    with STAGE_SECONDS.time(stage='match'):
+        matches = match_registered_users(df_clean, 'student_id', 'grade', registered_users)
+    logger.info(f"Matched {len(matches)} registered students in {subject}")
+
+    # 5. A corrected re-post of the subject only touches students whose result moved
+    previous = await adb.get_subject_snapshot(subject)
+    changed = diff_against_snapshot(matches, previous['snapshot'] if previous else None)
+    if previous:
+        logger.info(f"{subject}: {len(changed)} of {len(matches)} students changed since "
+                    f"version {previous['file_hash'][:12]}")
+    if changed.empty:
+        return matches, changed.assign(chart_path=None), []
+
+    # 6. Render one chart per distinct grade off the event loop; students with the
+    #    same grade share the chart and, once uploaded, the Telegram media too
+    chart_ids = changed['grade'].map(lambda g: f"{chart_prefix}_{g:g}")
+    with STAGE_SECONDS.time(stage='charts'):
+        distinct = changed.assign(chart_id=chart_ids).drop_duplicates('chart_id')
+        chart_paths = await renderer.render(
+            df_clean['grade'], zip(distinct['chart_id'], distinct['grade']), subject, summary=summary,
+            hold=held
+        )
+
+    # 7. Persist the changed grades in a handful of batched requests. Retries can outlast
+    #    DB_TIMEOUT; if even the bulk timeout passes, the write finishes in its thread and
+    #    the students are still notified
+    failed = []
+    with STAGE_SECONDS.time(stage='db_write'):
+        try:
+            failed = await adb.add_grades_bulk(changed, subject, str(source_id), file_hash=file_hash,
+                                               timeout=GRADE_WRITE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"Writing {len(changed)} grades for {subject} is still running after "
+                         f"{GRADE_WRITE_TIMEOUT}s; notifying without waiting for it.")
+    changed = changed.assign(chart_path=[chart_paths.get(chart_id) for chart_id in chart_ids])
+    if failed:
+        logger.warning(f"{subject}: {len(failed)} grades were not stored; those students are retried "
+                       f"when the sheet is posted again.")
+        matches = matches[~matches['student_id'].isin(failed)]
+        changed = changed[~changed['student_id'].isin(failed)]
+    return matches, changed, list(failed)
+
+def normalize_student_ids(ids):
+    """Returns a join key per ID that ignores Excel float suffixes ("123.0"),
+    surrounding whitespace and leading zeros."""
+    keys = ids.astype(str).str.strip().str.replace(r'\.0+$', '', regex=True)
+    keys = keys.str.lstrip('0')
+    return keys.mask(keys == '', '0')
+
+def match_registered_users(df_clean, id_col, grade_col, registered_users):
+    """Matches registered users against a cleaned grade sheet with a single indexed join.
+
+    Returns one row per matched student with the registered `student_id` and its
+    `grade`, `rank` and `percentile`. When an ID appears more than once in the
+    sheet (or in the users table) the first occurrence wins.
+    """
+    columns = ['student_id', 'grade', 'rank', 'percentile']
+    users = pd.DataFrame(registered_users)
+    if users.empty or 'student_id' not in users.columns:
+        return pd.DataFrame(columns=columns)
+
+    users = users[['student_id']].dropna().astype(str)
+    users.index = normalize_student_ids(users['student_id'])
+    users = users[~users.index.duplicated(keep='first')]
+
+    sheet = df_clean[[grade_col, 'rank', 'percentile']].rename(columns={grade_col: 'grade'})
+    sheet.index = normalize_student_ids(df_clean[id_col])
+    sheet = sheet[~sheet.index.duplicated(keep='first')]
+
+    matches = users.join(sheet, how='inner')
+    matches['rank'] = matches['rank'].astype(int)
+    matches['percentile'] = matches['percentile'].round(2)
+    return matches[columns].reset_index(drop=True)
+
+def diff_against_snapshot(matches, snapshot):
+    """Returns the rows of `matches` whose grade, rank or percentile differ from `snapshot`.
+
+    `snapshot` is the columnar dict saved for the subject's previous version (None for
+    a first version). Students missing from it, e.g. registered since, count as changed.
+    """
+    if not snapshot or matches.empty:
+        return matches
+    previous = pd.DataFrame(snapshot, columns=SNAPSHOT_COLUMNS).drop_duplicates('student_id').set_index('student_id')
+    joined = matches.join(previous, on='student_id', rsuffix='_prev')
+    moved = (
+        joined['grade_prev'].isna()
+        | (joined['grade'] != joined['grade_prev'])
+        | (joined['rank'] != joined['rank_prev'])
+        | (joined['percentile'] != joined['percentile_prev'])
+    )
+    return matches[moved.to_numpy()].reset_index(drop=True)
 
 def generate_bell_curve(all_grades, student_grade, student_id, subject):
+    """Renders a single chart synchronously. Batches should go through `renderer.render`."""
     try:
-        plt.figure(figsize=(10, 6))
-        sns.histplot(all_grades, kde=True, stat="density", color='skyblue', alpha=0.6)
-        
-        # Fit normal distribution
-        mu, std = norm.fit(all_grades)
-        xmin, xmax = plt.xlim()
-        x = np.linspace(xmin, xmax, 100)
-        p = norm.pdf(x, mu, std)
-        plt.plot(x, p, 'k', linewidth=2)
-        
-        # Mark student position
-        plt.axvline(student_grade, color='red', linestyle='--', label=f'Your Grade: {student_grade}')
-        plt.scatter([student_grade], [norm.pdf(student_grade, mu, std)], color='red', s=100, zorder=5)
-        
-        plt.title(f"Grade Distribution - {subject}")
-        plt.xlabel("Grade")
-        plt.ylabel("Density")
-        plt.legend()
-        
-        chart_filename = f"{student_id}_{subject}_chart.png"
-        chart_path = os.path.join(CHART_DIR, chart_filename)
-        plt.savefig(chart_path)
-        plt.close()
-        return chart_path
+        dist = compute_distribution(all_grades)
+        paths = _render_chunk(dist, [(str(student_id), float(student_grade))], subject,
+                              renderer.size, renderer.dpi)
+        return paths.get(str(student_id))
     except Exception as e:
         logger.error(f"Failed to generate chart: {e}")
         return None
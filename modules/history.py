@@ -0,0 +1,39 @@
+def merge_results(results, new_results):
+    """Folds (subject, grade) pairs into a student's ordered result list.
+
+    A subject seen before keeps its position and takes the new grade (a corrected
+    sheet), so re-applying the same rows is a no-op.
+    """
+    merged = [list(r) for r in results]
+    position = {subject: i for i, (subject, _) in enumerate(merged)}
+    for subject, grade in new_results:
+        if subject in position:
+            merged[position[subject]][1] = float(grade)
+        else:
+            position[subject] = len(merged)
+            merged.append([subject, float(grade)])
+    return merged
+
+def summarize_results(results):
+    """Aggregates stored next to the result list: count, average, best/last grade and trend.
+
+    `trend` is the least-squares slope of the grades in arrival order, in grade points
+    per result (positive when a student is improving).
+    """
+    grades = [grade for _, grade in results]
+    n = len(grades)
+    if n == 0:
+        return {'result_count': 0, 'average': None, 'trend': None, 'best_grade': None,
+                'last_grade': None, 'last_subject': None}
+    mean_x = (n - 1) / 2
+    mean_y = sum(grades) / n
+    spread = sum((x - mean_x) ** 2 for x in range(n))
+    trend = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(grades)) / spread if spread else 0.0
+    return {
+        'result_count': n,
+        'average': round(mean_y, 2),
+        'trend': round(trend, 3),
+        'best_grade': max(grades),
+        'last_grade': grades[-1],
+        'last_subject': results[-1][0],
+    }
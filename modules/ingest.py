@@ -0,0 +1,241 @@
+import io
+import csv
+import asyncio
+import logging
+import pandas as pd
+from config import INGEST_ENGINE, CSV_CHUNK_ROWS, INGEST_WORKERS, PDF_PAGES_PER_TASK
+from modules.stats import analyze_grades
+from modules.downloads import spooled_path
+from modules.workers import process_pool
+
+logger = logging.getLogger("Ingestion")
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.csv', '.pdf')
+
+# Shared by PDF page extraction and workbook sheets
+_pool = None
+
+def _get_pool():
+    # Created lazily so importing this module never starts processes
+    global _pool
+    if _pool is None:
+        _pool = process_pool(max(1, INGEST_WORKERS))
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _open_source(source):
+    """Readers take either a path or the raw bytes of an in-memory download."""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+def _is_csv(name):
+    return name.lower().endswith('.csv')
+
+def sniff_header(source, name=None, sheet=None):
+    """Reads only the header row of a CSV/XLSX file (of `sheet`, default the active one)."""
+    name = name or source
+    if _is_csv(name):
+        if isinstance(source, str):
+            f = open(source, newline='', encoding='utf-8-sig')
+        else:
+            f = io.TextIOWrapper(_open_source(source), newline='', encoding='utf-8-sig')
+        with f:
+            return next(csv.reader(f), [])
+    from openpyxl import load_workbook
+    wb = load_workbook(_open_source(source), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet is not None else wb.active
+        row = next(ws.iter_rows(max_row=1, values_only=True), ())
+        return ['' if c is None else str(c) for c in row]
+    finally:
+        wb.close()
+
+def _resolve_indices(header):
+    """Positions of the ID and grade columns, which are always two different cells."""
+    lowered = [str(c).lower().strip() for c in header]
+    id_idx = [i for i, low in enumerate(lowered) if 'id' in low or 'student' in low]
+    grade_idx = [i for i, low in enumerate(lowered) if 'grade' in low or 'mark' in low or 'result' in low]
+    # A single cell matching both (a title such as "Student Results 2024") is never a header
+    for i in id_idx:
+        j = next((j for j in grade_idx if j != i), None)
+        if j is not None:
+            return i, j
+    return None, None
+
+def resolve_columns(header):
+    """Finds the ID and grade columns (case-insensitive). Returns (id_col, grade_col) as named in the file."""
+    id_idx, grade_idx = _resolve_indices(header)
+    if id_idx is None:
+        return None, None
+    return header[id_idx], header[grade_idx]
+
+def _to_frame(ids, grades):
+    """Builds the standard (student_id, grade) frame every ingestion backend returns."""
+    return pd.DataFrame({
+        'student_id': pd.Series(ids, dtype='string').str.strip(),
+        'grade': pd.to_numeric(pd.Series(grades), errors='coerce').astype('float64'),
+    })
+
+def list_sheets(source):
+    """Sheet names of an .xlsx workbook, taken from its index without reading any cells."""
+    from openpyxl import load_workbook
+    wb = load_workbook(_open_source(source), read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+def _read_pandas(source, name, id_col, grade_col, sheet=None):
+    usecols = [id_col, grade_col]
+    if _is_csv(name):
+        chunks = []
+        # IDs stay strings so leading zeros survive; grades are parsed per chunk
+        for chunk in pd.read_csv(_open_source(source), usecols=usecols, dtype=str, chunksize=CSV_CHUNK_ROWS,
+                                 encoding='utf-8-sig'):
+            chunks.append(_to_frame(chunk[id_col], chunk[grade_col]))
+        return pd.concat(chunks, ignore_index=True) if chunks else _to_frame([], [])
+    df = pd.read_excel(_open_source(source), sheet_name=sheet if sheet is not None else 0,
+                       usecols=usecols, dtype=str, engine='openpyxl')
+    return _to_frame(df[id_col], df[grade_col])
+
+def _read_polars(source, name, id_col, grade_col, sheet=None):
+    import polars as pl
+    columns = [id_col, grade_col]
+    if _is_csv(name):
+        # infer_schema_length=0 reads every column as text
+        df = pl.read_csv(_open_source(source), columns=columns, infer_schema_length=0)
+    else:
+        df = pl.read_excel(_open_source(source), sheet_name=sheet, columns=columns, infer_schema_length=0)
+    return _to_frame(df[id_col].cast(pl.Utf8).to_list(), df[grade_col].cast(pl.Utf8).to_list())
+
+def _extract_pdf_pages(source, start, stop):
+    """Worker entry point: returns the table rows found on pages [start, stop), page by page.
+
+    Pages are opened one at a time and their caches flushed, so a worker never holds
+    more than a single page's objects in memory.
+    """
+    import pdfplumber
+    text_strategy = {'vertical_strategy': 'text', 'horizontal_strategy': 'text'}
+    pages = []
+    with pdfplumber.open(_open_source(source), pages=range(start + 1, stop + 1)) as pdf:
+        for page in pdf.pages:
+            # Ruled tables first; fall back to whitespace-aligned columns
+            tables = page.extract_tables() or page.extract_tables(table_settings=text_strategy)
+            rows = []
+            for table in tables:
+                for row in table:
+                    cells = ['' if c is None else str(c).strip() for c in row]
+                    if any(cells):
+                        rows.append(cells)
+            pages.append(rows)
+            page.close()
+    return pages
+
+def _pdf_page_count(source):
+    import pdfplumber
+    with pdfplumber.open(_open_source(source)) as pdf:
+        return len(pdf.pages)
+
+def _read_pdf(source, name):
+    """Extracts grade tables from every page in parallel and stitches them into one frame.
+
+    In-memory PDFs are spooled once to a temp file and the workers get its path, so
+    the document is never pickled into each page-range task.
+    """
+    with spooled_path(source, suffix='.pdf') as path:
+        return _read_pdf_pages(path, name)
+
+def _read_pdf_pages(path, name):
+    page_count = _pdf_page_count(path)
+    step = max(1, PDF_PAGES_PER_TASK)
+    pool = _get_pool()
+    futures = [pool.submit(_extract_pdf_pages, path, start, min(start + step, page_count))
+               for start in range(0, page_count, step)]
+
+    header, id_idx, grade_idx = None, None, None
+    ids, grades = [], []
+    preamble = set()
+    # Results are consumed in page order so the header from the first page applies to the rest
+    for future in futures:
+        for rows in future.result():
+            for cells in rows:
+                if header is None:
+                    id_idx, grade_idx = _resolve_indices(cells)
+                    if id_idx is not None:
+                        header = cells
+                    else:
+                        preamble.add(tuple(cells))
+                    continue
+                if cells == header or tuple(cells) in preamble or len(cells) <= max(id_idx, grade_idx):
+                    # Repeated page headers and titles, and stray fragments
+                    continue
+                ids.append(cells[id_idx])
+                grades.append(cells[grade_idx])
+
+    if header is None:
+        logger.error(f"Could not find a grade table with ID and Grade columns in {name} ({page_count} pages)")
+        return None
+    logger.info(f"Extracted {len(ids)} rows from {page_count} PDF pages in {name}")
+    return _to_frame(ids, grades)
+
+def read_grade_file(source, engine=INGEST_ENGINE, name=None, sheet=None):
+    """Reads only the ID and grade columns of a grade sheet.
+
+    `source` is a path or the file's bytes; `name` supplies the extension when it is
+    bytes. `sheet` picks a workbook sheet (default: the active one). Returns a frame
+    with `student_id` (string) and `grade` (float, NaN where not numeric), or None
+    when the required columns cannot be found.
+    """
+    name = name or source
+    if name.lower().endswith('.pdf'):
+        return _read_pdf(source, name)
+
+    header = sniff_header(source, name, sheet=sheet)
+    id_col, grade_col = resolve_columns(header)
+    if not id_col or not grade_col:
+        where = f"{name} [{sheet}]" if sheet is not None else name
+        logger.error(f"Could not find ID or Grade columns in {where}. Columns: {header}")
+        return None
+
+    if engine == 'polars':
+        try:
+            return _read_polars(source, name, id_col, grade_col, sheet=sheet)
+        except ImportError as e:
+            logger.warning(f"Polars engine unavailable ({e}); falling back to pandas.")
+    return _read_pandas(source, name, id_col, grade_col, sheet=sheet)
+
+def _analyze_sheet(source, name, sheet, engine):
+    """Worker entry point: reads one workbook sheet and ranks and summarizes it.
+
+    Returns (clean, summary) as described in `stats.analyze_grades`, or None when the
+    sheet has no ID and grade columns.
+    """
+    df = read_grade_file(source, engine=engine, name=name, sheet=sheet)
+    return None if df is None else analyze_grades(df)
+
+async def analyze_workbook(source, name, sheets, engine=INGEST_ENGINE):
+    """Parses and analyzes every sheet of a workbook in parallel on the ingestion pool.
+
+    Each worker receives the workbook path and its sheet name, so sheets are read
+    concurrently instead of one after another; an in-memory workbook is spooled to a
+    temp file once rather than pickled per sheet. Returns {sheet: result of
+    `_analyze_sheet`} in workbook order; a sheet that fails to parse maps to None.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_pool()
+    with spooled_path(source, suffix='.xlsx') as path:
+        futures = [loop.run_in_executor(pool, _analyze_sheet, path, name, sheet, engine) for sheet in sheets]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+    analyzed = {}
+    for sheet, result in zip(sheets, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Failed to read sheet {sheet!r} of {name}: {result}")
+            result = None
+        analyzed[sheet] = result
+    return analyzed
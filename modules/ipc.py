@@ -0,0 +1,122 @@
+import json
+import hmac
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+from config import SECRET_KEY, CONTROL_HOST, CONTROL_PORT, ORCHESTRATOR_URL
+
+logger = logging.getLogger("ControlChannel")
+
+TOPICS = ('channels', 'settings')
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    """Local control endpoints served by the Telegram orchestrator process.
+
+    GET  /jobs                 -> job queue snapshot (JSON)
+    GET  /metrics              -> Prometheus text
+    GET  /backfill             -> history backfill progress (JSON)
+    POST /backfill             -> start a history backfill ({"channel_ids": [...], "notify": bool})
+    POST /invalidate/<topic>   -> drop cached config and notify subscribers
+    """
+
+    def _authorized(self):
+        return hmac.compare_digest(self.headers.get('X-Control-Token', ''), SECRET_KEY)
+
+    def _reply(self, status, body, content_type='application/json'):
+        payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if not self._authorized():
+            return self._reply(403, {'status': 'forbidden'})
+        if self.path == '/jobs':
+            from modules.jobs import job_queue
+            return self._reply(200, {'queued': job_queue.depth, 'running': job_queue.running,
+                                     'jobs': job_queue.snapshot()})
+        if self.path == '/metrics':
+            from modules.metrics import registry
+            return self._reply(200, registry.render(), 'text/plain; version=0.0.4')
+        if self.path == '/backfill':
+            from modules.backfill import backfiller
+            return self._reply(200, backfiller.status())
+        self._reply(404, {'status': 'not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return self._reply(403, {'status': 'forbidden'})
+        if self.path == '/backfill':
+            return self._start_backfill()
+        topic = self.path.rsplit('/', 1)[-1]
+        if not self.path.startswith('/invalidate/') or topic not in TOPICS:
+            return self._reply(404, {'status': 'not found'})
+        from modules.database import db
+        db.invalidate(topic)
+        logger.info(f"Invalidated {topic} on request from the dashboard.")
+        self._reply(200, {'status': 'success'})
+
+    def _start_backfill(self):
+        from modules.backfill import backfiller
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            return self._reply(400, {'status': 'error', 'message': 'invalid JSON'})
+        if not backfiller.request(body.get('channel_ids'), notify=body.get('notify', True)):
+            return self._reply(409, {'status': 'error', 'message': 'backfill already running or listener not started'})
+        self._reply(202, {'status': 'started'})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def start_control_server(host=CONTROL_HOST, port=CONTROL_PORT):
+    """Serves the control endpoints from a daemon thread and returns the server."""
+    server = ThreadingHTTPServer((host, port), _ControlHandler)
+    threading.Thread(target=server.serve_forever, name='control-server', daemon=True).start()
+    logger.info(f"Control channel listening on {host}:{port}")
+    return server
+
+class OrchestratorClient:
+    """Used by dashboard workers to reach the orchestrator's control channel."""
+
+    def __init__(self, base_url=ORCHESTRATOR_URL, timeout=2):
+        self.base_url = (base_url or '').rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['X-Control-Token'] = SECRET_KEY
+
+    @property
+    def enabled(self):
+        return bool(self.base_url)
+
+    def notify(self, topic):
+        """Best effort: the orchestrator's periodic refresh catches anything missed here."""
+        try:
+            self.session.post(f"{self.base_url}/invalidate/{topic}", timeout=self.timeout).raise_for_status()
+        except Exception as e:
+            logger.warning(f"Could not notify orchestrator about {topic} change: {e}")
+
+    def get_jobs(self):
+        response = self.session.get(f"{self.base_url}/jobs", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def start_backfill(self, channel_ids=None, notify=True):
+        response = self.session.post(f"{self.base_url}/backfill", json={'channel_ids': channel_ids, 'notify': notify},
+                                     timeout=self.timeout)
+        return response.status_code, response.json()
+
+    def get_backfill(self):
+        response = self.session.get(f"{self.base_url}/backfill", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_metrics(self):
+        response = self.session.get(f"{self.base_url}/metrics", timeout=self.timeout)
+        response.raise_for_status()
+        return response.text
+
+orchestrator = OrchestratorClient()
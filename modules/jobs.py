@@ -0,0 +1,143 @@
+import time
+import asyncio
+import itertools
+import logging
+from collections import OrderedDict
+from config import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_HISTORY
+from modules import metrics, analytics
+from modules.downloads import as_grade_file
+
+logger = logging.getLogger("JobQueue")
+
+class FileJob:
+    def __init__(self, job_id, file, source_id, document_id=None, size=None, notify=True):
+        self.id = job_id
+        self.file = as_grade_file(file)
+        self.source_id = source_id
+        self.document_id = document_id
+        self.notify = notify
+        self.size = size if size is not None else self.file.size
+        self.status = 'queued'
+        self.outcome = None
+        self.error = None
+        self.queued_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._finished = asyncio.Event()
+
+    async def wait(self):
+        """Waits until the job has finished, whatever its outcome."""
+        await self._finished.wait()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'file_name': self.file.name,
+            'source_id': str(self.source_id),
+            'size': self.size,
+            'status': self.status,
+            'outcome': self.outcome,
+            'error': self.error,
+            'queued_at': self.queued_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'wait_seconds': round(self.started_at - self.queued_at, 3) if self.started_at else None,
+            'run_seconds': round(self.finished_at - self.started_at, 3) if self.finished_at else None,
+        }
+
+class FileJobQueue:
+    """Bounded priority queue of grade files drained by a fixed pool of workers.
+
+    Smaller files run first. `submit` waits while the queue is full, which pushes back
+    on the listener instead of piling up concurrent parses. The most recent
+    `history` jobs are kept for the dashboard.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, maxsize=JOB_QUEUE_SIZE, history=JOB_HISTORY):
+        self.workers = max(1, int(workers))
+        self.maxsize = maxsize
+        self.history = history
+        self.jobs = OrderedDict()
+        self._ids = itertools.count(1)
+        self._queue = None
+        self._tasks = []
+
+    def _ensure_started(self):
+        # Workers are bound to the loop that first submits a job
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue(maxsize=self.maxsize)
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+            logger.info(f"Started {self.workers} file processing workers.")
+
+    @property
+    def depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def running(self):
+        return sum(1 for job in list(self.jobs.values()) if job.status == 'running')
+
+    async def submit(self, file, source_id, document_id=None, size=None, notify=True):
+        """Queues a GradeFile or path; the job cleans up temporary downloads when it finishes."""
+        self._ensure_started()
+        job = FileJob(next(self._ids), file, source_id, document_id, size, notify)
+        self.jobs[job.id] = job
+        self._trim_history()
+        # Job id breaks ties so equal sizes keep arrival order
+        await self._queue.put((job.size, job.id, job))
+        logger.info(f"Queued job {job.id} for {job.file.name} ({job.size} bytes, {self.depth} waiting)")
+        return job
+
+    def _trim_history(self):
+        while len(self.jobs) > self.history:
+            oldest_id, oldest = next(iter(self.jobs.items()))
+            if oldest.status in ('queued', 'running'):
+                break
+            self.jobs.pop(oldest_id)
+
+    def snapshot(self):
+        """Jobs newest first, as plain dicts."""
+        return [job.to_dict() for job in reversed(list(self.jobs.values()))]
+
+    async def join(self):
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    async def _worker(self, index):
+        while True:
+            _, _, job = await self._queue.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            try:
+                # No-op once warm; otherwise the first file pays for the analytics imports off the loop
+                engine = await asyncio.to_thread(analytics.load)
+                job.outcome = await engine.process_file(job.file, job.source_id, document_id=job.document_id,
+                                                        notify=job.notify)
+                job.status = 'failed' if job.outcome in ('error', 'partial') else 'done'
+                if job.outcome == 'partial':
+                    job.error = "Some grades could not be stored; post the file again to retry them."
+            except asyncio.CancelledError:
+                job.status = 'cancelled'
+                raise
+            except Exception as e:
+                job.status = 'failed'
+                job.error = str(e)
+                logger.error(f"Job {job.id} failed: {e}")
+            finally:
+                job.finished_at = time.time()
+                job.file.cleanup()
+                job._finished.set()
+                self._queue.task_done()
+                self._trim_history()
+
+job_queue = FileJobQueue()
+
+metrics.gauge('grades_job_queue_depth', 'Grade files waiting for a worker.', lambda: job_queue.depth)
+metrics.gauge('grades_jobs_running', 'Grade files currently being processed.', lambda: job_queue.running)
@@ -2,8 +2,12 @@ import os
 import asyncio
 import logging
 from telethon import TelegramClient, events, errors
-from config import API_ID, API_HASH, DOWNLOAD_DIR
-from modules.database import db
+from config import API_ID, API_HASH, CHANNEL_REFRESH_INTERVAL
+from modules.database import db, adb
+from modules.metrics import STAGE_SECONDS
+from modules.jobs import job_queue
+from modules.downloads import download_document, prune_downloads
+from modules.backfill import backfiller
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -13,7 +17,36 @@ class GradeListener:
         self.api_id = API_ID
         self.api_hash = API_HASH
         self.client = None
-        self.monitored_channels = []
+        self.monitored_channels = set()
+        self._loop = None
+
+    async def reload_channels(self):
+        """Re-reads active channels; the handler filter sees the new set immediately."""
+        try:
+            channels_data = await adb.get_monitored_channels()
+        except Exception as e:
+            logger.error(f"Failed to load monitored channels: {e}")
+            return
+        if channels_data is None:
+            # A failed poll must not stop monitoring; keep the last known set
+            logger.warning(f"Could not reload channels; still monitoring {len(self.monitored_channels)}.")
+            return
+        channels = {int(c['channel_id']) for c in channels_data if c.get('is_active', True)}
+        added, removed = channels - self.monitored_channels, self.monitored_channels - channels
+        self.monitored_channels = channels
+        if added or removed:
+            logger.info(f"Now monitoring {len(channels)} channels (added {sorted(added)}, removed {sorted(removed)}).")
+
+    def _on_channels_changed(self):
+        # Called from the dashboard thread after a channel write
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.reload_channels()))
+
+    async def _poll_channels(self):
+        """Picks up channel changes made by other processes."""
+        while True:
+            await asyncio.sleep(CHANNEL_REFRESH_INTERVAL)
+            await self.reload_channels()
 
     async def start(self):
         """Starts the Telegram Userbot client within the current event loop."""
@@ -37,17 +70,20 @@ class GradeListener:
             logger.error(f"Failed to start userbot: {e}")
             return
         
-        # Load channels from DB
-        try:
-            channels_data = db.get_monitored_channels()
-            self.monitored_channels = [int(c['channel_id']) for c in channels_data]
-            logger.info(f"Loaded {len(self.monitored_channels)} channels from database.")
-        except Exception as e:
-            logger.error(f"Failed to load monitored channels: {e}")
-            self.monitored_channels = []
-        
-        # Filter for documents
-        @self.client.on(events.NewMessage(chats=self.monitored_channels))
+        # Leftovers from earlier runs fall under the download retention policy
+        await asyncio.to_thread(prune_downloads)
+
+        # Load channels from DB and keep them live
+        await self.reload_channels()
+        logger.info(f"Loaded {len(self.monitored_channels)} channels from database.")
+        self._loop = asyncio.get_running_loop()
+        db.subscribe('channels', self._on_channels_changed)
+        # Dashboard-triggered history backfills run on this client
+        backfiller.attach(self.client)
+        poll_task = asyncio.create_task(self._poll_channels())
+
+        # Filter for documents; a set lookup per message lets the channel list change at runtime
+        @self.client.on(events.NewMessage(func=lambda e: e.chat_id in self.monitored_channels))
         async def handler(event):
             if event.message.document:
                 file_name = event.message.file.name or "unknown_file"
@@ -56,17 +92,28 @@ class GradeListener:
                 if file_ext in ['.pdf', '.xlsx', '.csv']:
                     logger.info(f"New grade file detected: {file_name} in channel {event.chat_id}")
                     try:
-                        # Download the file
-                        path = await event.download_media(file=DOWNLOAD_DIR)
-                        logger.info(f"Downloaded to: {path}")
+                        # Forwarded copies share the document id, so skip them before downloading
+                        document_id = event.message.document.id
+                        if await adb.get_processed_file(document_id=document_id):
+                            logger.info(f"Skipping already processed document {document_id} ({file_name})")
+                            return
+
+                        # Small files stay in memory; large ones stream to a temp file in parallel parts
+                        with STAGE_SECONDS.time(stage='download'):
+                            grade_file = await download_document(self.client, event.message, name=file_name)
+                        logger.info(f"Downloaded {grade_file}")
                         
-                        # Trigger analysis engine
-                        from modules.engine import process_file
-                        # We run this as a background task so the listener isn't blocked
-                        asyncio.create_task(process_file(path, event.chat_id))
+                        # Queue for analysis; waits here only when the queue is full.
+                        # The job removes any temp file once it is done.
+                        await job_queue.submit(grade_file, event.chat_id, document_id=document_id,
+                                               size=event.message.file.size)
+                        await asyncio.to_thread(prune_downloads)
                         
                     except Exception as e:
                         logger.error(f"Error handling file {file_name}: {e}")
 
         logger.info(f"Userbot is now monitoring {len(self.monitored_channels)} channels for documents.")
-        await self.client.run_until_disconnected()
+        try:
+            await self.client.run_until_disconnected()
+        finally:
+            poll_task.cancel()
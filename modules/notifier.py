@@ -1,31 +1,77 @@
 import logging
-import asyncio
-from telethon import TelegramClient, events, errors
-from config import API_ID, API_HASH, BOT_TOKEN
-from modules.database import db
+from telethon import events
+from config import API_ID, API_HASH, BOT_TOKENS
+from modules.database import adb
+from modules.directory import directory
+from modules.botpool import BotPool
+from modules import metrics
 
 # Configure logging
 logger = logging.getLogger("NotifierBot")
 
-# Initialize the bot client instance without starting it
-bot = None
-if API_ID and API_HASH:
-    bot = TelegramClient('bot_session', int(API_ID), API_HASH)
-    logger.info("Notifier Bot instance initialized.")
+# Initialize one client and rate-limited dispatcher per bot token without starting them
+pool = None
+if API_ID and API_HASH and BOT_TOKENS:
+    pool = BotPool.from_tokens(BOT_TOKENS, API_ID, API_HASH)
+    logger.info(f"Notifier pool initialized with {len(pool.shards)} bots.")
+
+metrics.gauge('grades_notify_queue_depth', 'Notifications waiting in the dispatcher queues.',
+              lambda: pool.queue_depth if pool else 0)
+metrics.gauge('grades_notify_dead_letters', 'Notifications that exhausted their retries.',
+              lambda: len(pool.dead_letters) if pool else 0)
+metrics.gauge('grades_floodwait_seconds_total', 'Seconds of FloodWait imposed on the notifier bots.',
+              lambda: pool.total('flood_wait_seconds') if pool else 0)
 
 # State management for registration (in-memory for simplicity)
 registration_state = {}
 
-def register_handlers(client):
-    """Registers command handlers for the bot."""
+def register_handlers(shard):
+    """Registers command handlers for one bot of the pool."""
+    client = shard.client
     
     @client.on(events.NewMessage(pattern='/start'))
     async def start_handler(event):
         if not event.is_private:
             return
+        # Each student registers with their home bot so fan-out spreads over the pool
+        home = pool.home_shard(event.sender_id)
+        if home is not shard and home.username:
+            await event.respond(f"Please register with @{home.username} - that bot will send your grade notifications.")
+            return
         registration_state[event.sender_id] = 'AWAITING_ID'
         await event.respond("Welcome! Please enter your University ID number to register for grade notifications.")
 
+    @client.on(events.NewMessage(pattern=r'/history(?:@\w+)?(?:\s+(.+))?$'))
+    async def history_handler(event):
+        if not event.is_private:
+            return
+        user = directory.get_by_tg_id(event.sender_id)
+        if user is None:
+            await event.respond("You are not registered yet. Send /start to register your University ID.")
+            return
+        subject = (event.pattern_match.group(1) or '').strip() or None
+        try:
+            aggregate = await adb.get_student_aggregate(user['student_id'])
+            rows = await adb.get_latest_grades(user['student_id'], subject=subject, limit=10,
+                                               fields=['subject_name', 'grade', 'rank', 'percentile'])
+        except Exception as e:
+            logger.error(f"History lookup failed for {event.sender_id}: {e}")
+            await event.respond("Could not load your grades right now. Please try again later.")
+            return
+        if not rows:
+            await event.respond(f"No grades recorded for {subject}." if subject else "No grades recorded yet.")
+            return
+
+        lines = [f"Your latest results{f' in {subject}' if subject else ''}:"]
+        for row in rows:
+            lines.append(f"- {row['subject_name']}: {row['grade']} (rank {row['rank']}, "
+                         f"percentile {float(row['percentile']):.0f}%)")
+        if aggregate and aggregate.get('result_count'):
+            trend = aggregate.get('trend') or 0
+            lines.append(f"\nAverage over {aggregate['result_count']} subjects: {aggregate['average']} "
+                         f"(trend {trend:+.2f} per result)")
+        await event.respond("\n".join(lines))
+
     @client.on(events.NewMessage)
     async def message_handler(event):
         if not event.is_private or event.text.startswith('/'):
@@ -44,12 +90,16 @@ def register_handlers(client):
                 sender = await event.get_sender()
                 full_name = f"{sender.first_name} {sender.last_name or ''}".strip()
                 
-                # Save to Supabase
-                db.supabase.table('users').upsert({
+                # Save to Supabase and make the student visible to the engine immediately
+                user = {
                     'student_id': university_id,
                     'tg_id': str(sender_id),
-                    'full_name': full_name
-                }).execute()
+                    'full_name': full_name,
+                    'bot_id': shard.bot_id
+                }
+                if await adb.upsert_user(user) is None:
+                    raise RuntimeError("users upsert returned no result")
+                directory.upsert(user)
                 
                 registration_state.pop(sender_id, None)
                 await event.respond(f"Success! I have registered your ID: {university_id}. I will notify you as soon as a new grade file is posted.")
@@ -58,39 +108,79 @@ def register_handlers(client):
                 logger.error(f"Registration failed for {sender_id}: {e}")
                 await event.respond("Registration failed due to a database error. Please try again later.")
 
-# Register handlers immediately on the instance
-if bot:
-    register_handlers(bot)
+# Register handlers immediately on every bot
+if pool:
+    for shard in pool.shards:
+        register_handlers(shard)
 
-async def notify_student(student_id, subject, grade, rank, percentile, chart_path):
-    global bot
-    if not bot or not bot.is_connected():
-        logger.error("Bot not connected. Cannot send notification.")
-        return
+def _recipient(student_id):
+    """Returns (bot shard, Telegram chat id) for a registered student, or None if they cannot be messaged."""
+    if not pool:
+        logger.error("Notifier bots not configured. Cannot send notification.")
+        metrics.NOTIFICATIONS_TOTAL.inc(result='not_connected')
+        return None
 
-    user = db.get_user_by_student_id(student_id)
+    user = directory.get(student_id)
     if not user:
+        metrics.NOTIFICATIONS_TOTAL.inc(result='unregistered')
+        return None
+
+    # Only the bot the student registered with is allowed to message them
+    shard = pool.shard_for(user)
+    if not shard.client.is_connected():
+        logger.error(f"Bot {shard.bot_id} not connected. Cannot notify student {student_id}.")
+        metrics.NOTIFICATIONS_TOTAL.inc(result='not_connected')
+        return None
+    return shard, int(user['tg_id'])
+
+async def _result_template():
+    return await adb.get_message_template(
+        'result_message_template',
+        "Subject: {subject}\nGrade: {grade}\nRank: {rank}\nPercentile: {percentile}%"
+    )
+
+async def notify_student(student_id, subject, grade, rank, percentile, chart_path, media_key=None):
+    recipient = _recipient(student_id)
+    if recipient is None:
         return
+    shard, tg_id = recipient
 
-    tg_id = int(user['tg_id'])
-    template = db.get_setting('result_message_template') or "Subject: {subject}\nGrade: {grade}\nRank: {rank}\nPercentile: {percentile}%"
-    
-    message = template.format(
+    template = await _result_template()
+    message = template.render(
         subject=subject,
         grade=grade,
         rank=rank,
         percentile=percentile
     )
 
-    try:
-        if chart_path and os.path.exists(chart_path):
-            await bot.send_message(tg_id, message, file=chart_path)
-        else:
-            await bot.send_message(tg_id, message)
+    delivered = await shard.dispatcher.send(tg_id, message, file=chart_path, media_key=media_key)
+    metrics.NOTIFICATIONS_TOTAL.inc(result='sent' if delivered else 'failed')
+    if delivered:
         logger.info(f"Notification sent to student {student_id} (TG: {tg_id})")
-    except errors.FloodWaitError as e:
-        logger.warning(f"FloodWait during notification: waiting {e.seconds}s")
-        await asyncio.sleep(e.seconds)
-        await bot.send_message(tg_id, message, file=chart_path)
-    except Exception as e:
-        logger.error(f"Failed to send notification to {tg_id}: {e}")
+    return delivered
+
+async def notify_student_results(student_id, results):
+    """Sends several subjects' results to one student as a single message.
+
+    `results` is a list of dicts with `subject`, `grade`, `rank`, `percentile`,
+    `chart_path` and `media_key`. Each subject is rendered with the result template,
+    and the charts go out as one album captioned with the combined text.
+    """
+    recipient = _recipient(student_id)
+    if recipient is None:
+        return
+    shard, tg_id = recipient
+
+    template = await _result_template()
+    message = "\n\n".join(
+        template.render(subject=r['subject'], grade=r['grade'], rank=r['rank'], percentile=r['percentile'])
+        for r in results
+    )
+    files = [r['chart_path'] for r in results]
+    keys = [r.get('media_key') for r in results]
+
+    delivered = await shard.dispatcher.send(tg_id, message, file=files, media_key=keys)
+    metrics.NOTIFICATIONS_TOTAL.inc(result='sent' if delivered else 'failed')
+    if delivered:
+        logger.info(f"Notification with {len(results)} results sent to student {student_id} (TG: {tg_id})")
+    return delivered
@@ -0,0 +1,449 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger("SQLiteStore")
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema.sql')
+
+# schema.sql is written for Postgres; these rewrites make it valid SQLite
+_TYPE_REWRITES = (
+    ('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+    ('TIMESTAMP WITH TIME ZONE', 'TIMESTAMP'),
+)
+
+OUTBOX_DDL = """
+CREATE TABLE IF NOT EXISTS _outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    payload TEXT,
+    on_conflict TEXT,
+    filters TEXT,
+    attempts INT DEFAULT 0
+)
+"""
+
+def schema_statements(path=SCHEMA_PATH):
+    """Splits schema.sql into SQLite statements. ALTERs only migrate older Postgres deployments."""
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().splitlines(keepends=True)
+    statements, buffer = [], ''
+    for line in lines:
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            # Drop comment lines so each statement starts with its keyword
+            statement = '\n'.join(l for l in buffer.splitlines() if not l.lstrip().startswith('--')).strip()
+            buffer = ''
+            if statement.upper().startswith('ALTER TABLE'):
+                continue
+            for postgres, sqlite in _TYPE_REWRITES:
+                statement = statement.replace(postgres, sqlite)
+            statements.append(statement)
+    return statements
+
+def _normalize_timestamp(value):
+    """Renders a timestamp in SQLite's own CURRENT_TIMESTAMP form, UTC 'YYYY-MM-DD HH:MM:SS[.ffffff]'.
+
+    Rows copied from Supabase carry ISO strings with a 'T' and an offset; stored as-is
+    they would not compare correctly against locally defaulted timestamps.
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return value
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=' ')
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+class SQLiteQuery:
+    """The subset of the Supabase query builder that `Database` uses, compiled to SQL."""
+
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self._columns = None
+        self._filters = []
+        self._order = None
+        self._limit = None
+        self._write = None
+
+    def select(self, columns='*'):
+        self._columns = None if columns.strip() == '*' else [c.strip() for c in columns.split(',')]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, '=', value))
+        return self
+
+    def gt(self, column, value):
+        self._filters.append((column, '>', value))
+        return self
+
+    def lt(self, column, value):
+        self._filters.append((column, '<', value))
+        return self
+
+    def in_(self, column, values):
+        self._filters.append((column, 'IN', list(values)))
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count):
+        self._limit = int(count)
+        return self
+
+    def insert(self, data):
+        self._write = ('insert', data, None)
+        return self
+
+    def upsert(self, data, on_conflict=None):
+        self._write = ('upsert', data, on_conflict)
+        return self
+
+    def update(self, data):
+        self._write = ('update', data, None)
+        return self
+
+    def delete(self):
+        self._write = ('delete', None, None)
+        return self
+
+    def execute(self):
+        if self._write:
+            return Response(self.client._write(self.table, *self._write, filters=self._filters))
+        return Response(self.client._select(self))
+
+class SQLiteClient:
+    """Embedded store with the Supabase client's table API, backed by the tables in schema.sql.
+
+    Runs in WAL mode so readers never wait for the writer; each thread gets its own
+    connection and writes are serialized in-process. With `outbox=True` every write is
+    also journaled, in the same transaction, to `_outbox` for the write-behind replicator.
+    """
+
+    def __init__(self, path, outbox=False, busy_timeout=5.0):
+        self.path = path
+        self.outbox = outbox
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = self._conn()
+        with self._write_lock, conn:
+            for statement in schema_statements():
+                conn.execute(statement)
+            conn.execute(OUTBOX_DDL)
+        self._columns = {}
+        for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+            info = conn.execute(f"PRAGMA table_info({_quote(table)})").fetchall()
+            self._columns[table] = {
+                'types': {row['name']: (row['type'] or '').upper() for row in info},
+                'primary_key': tuple(row['name'] for row in sorted(info, key=lambda r: r['pk']) if row['pk']),
+            }
+        logger.info(f"SQLite store ready at {path} (outbox {'on' if outbox else 'off'}).")
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def table(self, name):
+        return SQLiteQuery(self, name)
+
+    def _column_types(self, table):
+        try:
+            return self._columns[table]['types']
+        except KeyError:
+            raise ValueError(f"Unknown table {table!r}") from None
+
+    def _check_columns(self, table, columns):
+        types = self._column_types(table)
+        unknown = [c for c in columns if c not in types]
+        if unknown:
+            raise ValueError(f"Unknown columns for {table}: {unknown}")
+
+    def _encode(self, value, kind=''):
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        if kind == 'TIMESTAMP':
+            return _normalize_timestamp(value)
+        return value
+
+    def _decode_row(self, table, row):
+        types = self._column_types(table)
+        out = {}
+        for key in row.keys():
+            value = row[key]
+            kind = types.get(key, '')
+            if value is not None and kind == 'JSONB':
+                value = json.loads(value)
+            elif value is not None and kind == 'BOOLEAN':
+                value = bool(value)
+            out[key] = value
+        return out
+
+    def _where(self, table, filters):
+        if not filters:
+            return '', []
+        self._check_columns(table, [column for column, _, _ in filters])
+        types = self._column_types(table)
+        clauses, params = [], []
+        for column, op, value in filters:
+            if op == 'IN':
+                clauses.append(f"{_quote(column)} IN ({', '.join('?' for _ in value) or 'NULL'})")
+                params.extend(self._encode(v, types[column]) for v in value)
+            else:
+                clauses.append(f"{_quote(column)} {op} ?")
+                params.append(self._encode(value, types[column]))
+        return f" WHERE {' AND '.join(clauses)}", params
+
+    def _select(self, query):
+        columns = '*'
+        if query._columns:
+            self._check_columns(query.table, query._columns)
+            columns = ', '.join(_quote(c) for c in query._columns)
+        where, params = self._where(query.table, query._filters)
+        sql = f"SELECT {columns} FROM {_quote(query.table)}{where}"
+        if query._order:
+            column, desc = query._order
+            self._check_columns(query.table, [column])
+            sql += f" ORDER BY {_quote(column)}{' DESC' if desc else ''}"
+        if query._limit is not None:
+            sql += f" LIMIT {int(query._limit)}"
+        rows = self._conn().execute(sql, params).fetchall()
+        return [self._decode_row(query.table, row) for row in rows]
+
+    def _write(self, table, operation, data, on_conflict, filters=(), journal=True):
+        rows = [data] if isinstance(data, dict) else list(data or [])
+        conn = self._conn()
+        with self._write_lock, conn:
+            if operation in ('insert', 'upsert'):
+                self._insert_rows(conn, table, rows, operation, on_conflict)
+            elif operation == 'update':
+                self._check_columns(table, data.keys())
+                types = self._column_types(table)
+                where, params = self._where(table, filters)
+                assignments = ', '.join(f"{_quote(c)} = ?" for c in data)
+                conn.execute(f"UPDATE {_quote(table)} SET {assignments}{where}",
+                             [self._encode(v, types[c]) for c, v in data.items()] + params)
+            elif operation == 'delete':
+                where, params = self._where(table, filters)
+                conn.execute(f"DELETE FROM {_quote(table)}{where}", params)
+            if self.outbox and journal:
+                conn.execute(
+                    "INSERT INTO _outbox (table_name, operation, payload, on_conflict, filters) VALUES (?, ?, ?, ?, ?)",
+                    (table, operation, json.dumps(data), on_conflict,
+                     json.dumps([[column, op, value] for column, op, value in filters]))
+                )
+        return rows
+
+    def _insert_rows(self, conn, table, rows, operation, on_conflict):
+        # Rows are grouped by their key set so each group is one executemany
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row.keys()), []).append(row)
+        keys = tuple(k.strip() for k in on_conflict.split(',')) if on_conflict else self._columns[table]['primary_key']
+        types = self._column_types(table)
+        for columns, group in groups.items():
+            self._check_columns(table, columns)
+            sql = (f"INSERT INTO {_quote(table)} ({', '.join(_quote(c) for c in columns)}) "
+                   f"VALUES ({', '.join('?' for _ in columns)})")
+            updates = [c for c in columns if c not in keys]
+            if operation == 'upsert' and all(k in columns for k in keys):
+                # Same semantics as PostgREST: conflicts on the key update the remaining columns
+                action = (f"DO UPDATE SET {', '.join(f'{_quote(c)} = excluded.{_quote(c)}' for c in updates)}"
+                          if updates else 'DO NOTHING')
+                sql += f" ON CONFLICT ({', '.join(_quote(k) for k in keys)}) {action}"
+            conn.executemany(sql, [[self._encode(row[c], types[c]) for c in columns] for row in group])
+
+    def load_rows(self, table, rows):
+        """Copies rows pulled from the remote store without journaling them back."""
+        if not rows:
+            return 0
+        known = self._column_types(table)
+        rows = [{k: v for k, v in row.items() if k in known} for row in rows]
+        self._write(table, 'upsert', rows, None, journal=False)
+        return len(rows)
+
+    def count(self, table):
+        return self._conn().execute(f"SELECT COUNT(*) FROM {_quote(table)}").fetchone()[0]
+
+    def has_pending(self, table):
+        """True while the outbox still holds local writes to `table`."""
+        return self._conn().execute(
+            "SELECT 1 FROM _outbox WHERE table_name = ? LIMIT 1", (table,)).fetchone() is not None
+
+    def pending(self, limit):
+        return self._conn().execute(
+            "SELECT * FROM _outbox ORDER BY id LIMIT ?", (int(limit),)).fetchall()
+
+    def acknowledge(self, ids):
+        with self._write_lock, self._conn() as conn:
+            conn.executemany("DELETE FROM _outbox WHERE id = ?", [(i,) for i in ids])
+
+    def record_attempt(self, ids):
+        with self._write_lock, self._conn() as conn:
+            conn.executemany("UPDATE _outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+
+class WriteBehindReplicator:
+    """Replays the SQLite outbox to Supabase in order, batching consecutive writes.
+
+    Runs on a daemon thread every `interval` seconds. Consecutive inserts/upserts to
+    the same table with the same conflict key are merged into a single request of up
+    to `batch_size` rows. A failed batch stays in the outbox and is retried with the
+    next pass. Entries are dropped only after `max_attempts` failures.
+    """
+
+    # Rows the bot needs on a fresh local store; grades and summaries are history only
+    BOOTSTRAP_TABLES = ('users', 'channels', 'settings', 'processed_files', 'backfill_checkpoints',
+                        'subject_snapshots', 'student_aggregates')
+    # Seeded with defaults by schema.sql, so the remote rows are always copied over them
+    SEEDED_TABLES = ('settings',)
+
+    def __init__(self, local, remote, interval=5.0, batch_size=500, max_attempts=10):
+        self.local = local
+        self.remote = remote
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self.max_attempts = max_attempts
+        self.stats = {'replicated': 0, 'failed_batches': 0, 'dropped': 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def bootstrap(self, tables=BOOTSTRAP_TABLES, page_size=1000):
+        """Pulls tables that are still empty locally from Supabase, e.g. on first start.
+
+        Seeded tables are pulled on every start unless local changes to them are still
+        waiting in the outbox; the remote rows replace the schema defaults.
+        """
+        for table in tables:
+            if table in self.SEEDED_TABLES:
+                if self.local.has_pending(table):
+                    continue
+            elif self.local.count(table):
+                continue
+            copied, start = 0, 0
+            while True:
+                rows = self.remote.table(table).select('*').range(start, start + page_size - 1).execute().data
+                copied += self.local.load_rows(table, rows)
+                if len(rows) < page_size:
+                    break
+                start += page_size
+            if copied:
+                logger.info(f"Bootstrapped {copied} {table} rows from Supabase.")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='db-replicator', daemon=True)
+            self._thread.start()
+            logger.info(f"Write-behind replication to Supabase every {self.interval}s.")
+
+    def stop(self, flush=True):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 5)
+            self._thread = None
+        if flush:
+            self.flush()
+
+    @property
+    def backlog(self):
+        return self.local.count('_outbox')
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Replication pass failed: {e}")
+
+    def flush(self):
+        """Sends everything pending (batch by batch) until the outbox is empty or a batch fails."""
+        while True:
+            entries = self.local.pending(self.batch_size)
+            if not entries:
+                return
+            batch = self._next_batch(entries)
+            ids = [entry['id'] for entry in batch]
+            try:
+                self._send(batch)
+            except Exception as e:
+                self.stats['failed_batches'] += 1
+                self.local.record_attempt(ids)
+                if max(entry['attempts'] for entry in batch) + 1 >= self.max_attempts:
+                    logger.error(f"Dropping {len(ids)} {batch[0]['table_name']} writes after "
+                                 f"{self.max_attempts} failed attempts: {e}")
+                    self.stats['dropped'] += len(ids)
+                    self.local.acknowledge(ids)
+                    continue
+                logger.warning(f"Replicating {len(ids)} {batch[0]['table_name']} writes failed: {e}")
+                return
+            self.local.acknowledge(ids)
+            self.stats['replicated'] += len(ids)
+
+    def _next_batch(self, entries):
+        first = entries[0]
+        if first['operation'] not in ('insert', 'upsert'):
+            return [first]
+        # PostgREST needs every row of one bulk request to have the same columns
+        def shape(entry):
+            payload = json.loads(entry['payload'])
+            rows = [payload] if isinstance(payload, dict) else payload
+            return (entry['operation'], entry['table_name'], entry['on_conflict'],
+                    tuple(sorted(rows[0])) if rows else ()), len(rows)
+
+        first_shape, _ = shape(first)
+        batch, rows = [], 0
+        for entry in entries:
+            entry_shape, count = shape(entry)
+            if entry_shape != first_shape or (batch and rows + count > self.batch_size):
+                break
+            batch.append(entry)
+            rows += count
+        return batch
+
+    def _send(self, batch):
+        first = batch[0]
+        query = self.remote.table(first['table_name'])
+        operation = first['operation']
+        if operation in ('insert', 'upsert'):
+            rows = []
+            for entry in batch:
+                payload = json.loads(entry['payload'])
+                rows.extend([payload] if isinstance(payload, dict) else payload)
+            if operation == 'insert':
+                query.insert(rows).execute()
+            elif first['on_conflict']:
+                query.upsert(rows, on_conflict=first['on_conflict']).execute()
+            else:
+                query.upsert(rows).execute()
+            return
+        query = query.update(json.loads(first['payload'])) if operation == 'update' else query.delete()
+        methods = {'=': 'eq', '>': 'gt', '<': 'lt', 'IN': 'in_'}
+        for column, op, value in json.loads(first['filters'] or '[]'):
+            query = getattr(query, methods[op])(column, value)
+        query.execute()
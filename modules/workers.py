@@ -0,0 +1,19 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from config import WORKER_START_METHOD
+
+# Imported once by the fork server, so workers start with them already loaded
+PRELOAD_MODULES = ['modules.ingest', 'modules.charts']
+
+def process_pool(max_workers):
+    """Returns a ProcessPoolExecutor whose workers do not inherit the main process's threads.
+
+    Pools are created lazily, after Telethon, the database executor and the dashboard
+    have started threads; a plain fork copies their locks (logging's included) in
+    whatever state they are in, which can deadlock a child. Workers keep the fork
+    server's working directory, so tasks must be given absolute paths.
+    """
+    context = multiprocessing.get_context(WORKER_START_METHOD)
+    if WORKER_START_METHOD == 'forkserver':
+        context.set_forkserver_preload(PRELOAD_MODULES)
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
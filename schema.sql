@@ -6,6 +6,7 @@ CREATE TABLE IF NOT EXISTS users (
     student_id VARCHAR(50) UNIQUE NOT NULL,
     tg_id BIGINT UNIQUE NOT NULL,
     full_name VARCHAR(255),
+    bot_id BIGINT,  -- notifier bot the student registered with; NULL means the primary bot
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -18,10 +19,85 @@ CREATE TABLE IF NOT EXISTS grades (
     rank INT,
     percentile FLOAT,
     file_source VARCHAR(255),
+    file_hash VARCHAR(64),
     processed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (student_id) REFERENCES users(student_id) ON DELETE CASCADE
 );
 
+-- Existing deployments: remember which notifier bot each student registered with
+ALTER TABLE users ADD COLUMN IF NOT EXISTS bot_id BIGINT;
+
+-- Existing deployments: grades written for the same file become idempotent upserts
+ALTER TABLE grades ADD COLUMN IF NOT EXISTS file_hash VARCHAR(64);
+CREATE UNIQUE INDEX IF NOT EXISTS grades_student_subject_file_idx
+    ON grades (student_id, subject_name, file_hash);
+-- History reads: newest-first per student or per subject, paginated by id
+CREATE INDEX IF NOT EXISTS grades_student_history_idx ON grades (student_id, id);
+CREATE INDEX IF NOT EXISTS grades_subject_history_idx ON grades (subject_name, id);
+
+-- Registry of grade files already processed (by content hash and Telegram document id)
+CREATE TABLE IF NOT EXISTS processed_files (
+    id SERIAL PRIMARY KEY,
+    file_hash VARCHAR(64) UNIQUE NOT NULL,
+    document_id BIGINT,
+    file_name VARCHAR(255),
+    file_source VARCHAR(255),
+    match_count INT DEFAULT 0,
+    processed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS processed_files_document_idx ON processed_files (document_id);
+
+-- Last channel message a history backfill has fully processed, so interrupted runs resume
+CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+    channel_id BIGINT PRIMARY KEY,
+    last_message_id BIGINT NOT NULL DEFAULT 0,
+    files_queued INT DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One statistics summary per subject and file, computed when the file is processed
+CREATE TABLE IF NOT EXISTS grade_summaries (
+    id SERIAL PRIMARY KEY,
+    subject_name VARCHAR(255) NOT NULL,
+    file_hash VARCHAR(64) NOT NULL,
+    file_source VARCHAR(255),
+    student_count INT NOT NULL,
+    mean FLOAT,
+    std FLOAT,
+    median FLOAT,
+    min_grade FLOAT,
+    max_grade FLOAT,
+    quantiles JSONB,
+    histogram JSONB,
+    withdrawals INT DEFAULT 0,
+    invalid_rows INT DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (subject_name, file_hash)
+);
+
+-- Latest results sent per subject (columnar JSON of student_id, grade, rank, percentile),
+-- so a corrected re-post only touches the students whose result moved
+CREATE TABLE IF NOT EXISTS subject_snapshots (
+    subject_name VARCHAR(255) PRIMARY KEY,
+    file_hash VARCHAR(64) NOT NULL,
+    snapshot JSONB NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-student aggregates, updated whenever that student's grades are written.
+-- `results` is the ordered [subject, grade] list the aggregates are derived from.
+CREATE TABLE IF NOT EXISTS student_aggregates (
+    student_id VARCHAR(50) PRIMARY KEY,
+    results JSONB NOT NULL,
+    result_count INT NOT NULL DEFAULT 0,
+    average FLOAT,
+    trend FLOAT,
+    best_grade FLOAT,
+    last_grade FLOAT,
+    last_subject VARCHAR(255),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Monitored channels table
 CREATE TABLE IF NOT EXISTS channels (
     id SERIAL PRIMARY KEY,
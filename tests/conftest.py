@@ -0,0 +1,61 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# Never reach the real services from .env: blank the credentials before config loads it
+for key in ('SUPABASE_URL', 'SUPABASE_KEY', 'TELEGRAM_API_ID', 'TELEGRAM_API_HASH',
+            'TELEGRAM_BOT_TOKEN', 'TELEGRAM_BOT_TOKENS'):
+    os.environ[key] = ''
+os.environ['DB_BACKEND'] = 'supabase'
+# Lets the worker fork server preload the package although tests change the working directory
+os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')]))
+
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Points the database singleton at an in-memory Supabase stand-in."""
+    from benchmarks.fakes import FakeSupabase
+    from modules.database import db
+    store = FakeSupabase()
+    monkeypatch.setattr(db, 'client', store)
+    db.cache.invalidate()
+    yield store
+    db.cache.invalidate()
+
+@pytest.fixture
+def pipeline(fake_db, monkeypatch, tmp_path):
+    """Runs the engine against the fake store and one fake bot, writing charts under tmp_path."""
+    from benchmarks.fakes import FakeTelegramClient
+    from modules.botpool import BotPool, BotShard
+    from modules.directory import directory
+    from modules import engine, notifier, ingest
+
+    monkeypatch.chdir(tmp_path)
+    client = FakeTelegramClient(latency=0, upload_latency=0)
+    monkeypatch.setattr(notifier, 'pool', BotPool([BotShard(1, client, global_rate=1000, per_chat_rate=1000)]))
+    monkeypatch.setattr(engine, '_subject_locks', {})
+
+    def register(*student_ids):
+        fake_db.table('users').upsert([
+            {'student_id': str(s), 'tg_id': str(s), 'full_name': f"Student {s}", 'bot_id': 1} for s in student_ids
+        ]).execute()
+        directory.load()
+
+    def process(*paths, **kwargs):
+        """Processes the files one after another and returns their outcome labels."""
+        async def run():
+            try:
+                return [await engine.process_file(path, 'test', **kwargs) for path in paths]
+            finally:
+                await notifier.pool.stop()
+        return asyncio.run(run())
+
+    yield SimpleNamespace(client=client, register=register, process=process)
+    engine.renderer.shutdown()
+    ingest.shutdown_pool()
@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from modules import backfill
+from modules.backfill import Backfiller
+from modules.database import db
+
+def message(message_id):
+    return SimpleNamespace(id=message_id, file=SimpleNamespace(ext='.csv', size=10),
+                           document=SimpleNamespace(id=1000 + message_id))
+
+class FakeHistoryClient:
+    def __init__(self, ids):
+        self.messages = [message(i) for i in ids]
+
+    async def iter_messages(self, channel_id, reverse=True, min_id=0, limit=None, filter=None, wait_time=None):
+        for m in self.messages:
+            if m.id > min_id:
+                yield m
+
+class FakeJob:
+    def __init__(self, status):
+        self.status = status
+
+    async def wait(self):
+        pass
+
+class FakeJobQueue:
+    """Finishes every job at once, failing the documents in `failing`."""
+
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.submitted = []
+
+    async def submit(self, file, source_id, document_id=None, size=None, notify=True):
+        self.submitted.append(document_id - 1000)
+        return FakeJob('failed' if document_id - 1000 in self.failing else 'done')
+
+@pytest.fixture
+def run_backfill(fake_db, monkeypatch):
+    async def fake_download(client, message, name=None):
+        return b''
+    monkeypatch.setattr(backfill, 'download_document', fake_download)
+
+    def run(ids, failing=()):
+        queue = FakeJobQueue(failing)
+        monkeypatch.setattr(backfill, 'job_queue', queue)
+        backfiller = Backfiller(batch_size=2, wait_time=0)
+
+        async def go():
+            backfiller.attach(FakeHistoryClient(ids))
+            return await backfiller.run([-100])
+        return asyncio.run(go()), queue.submitted
+    return run
+
+def test_checkpoint_stops_before_failed_file(run_backfill):
+    status, submitted = run_backfill(range(1, 6), failing={3})
+
+    assert submitted == [1, 2, 3, 4, 5]
+    assert status['channels']['-100']['failed'] == [3]
+    assert db.get_backfill_checkpoint(-100) == 2
+
+    # The next run starts right after the checkpoint and retries the failed file
+    _, submitted = run_backfill(range(1, 6))
+    assert submitted[0] == 3
+    assert db.get_backfill_checkpoint(-100) == 5
@@ -0,0 +1,21 @@
+import asyncio
+import os
+
+from modules.charts import ChartRenderer, holding_charts, prune_charts
+
+def test_pruning_spares_charts_a_job_has_not_sent_yet(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    renderer = ChartRenderer(workers=1)
+    try:
+        sent = asyncio.run(renderer.render([60, 70, 80], [('sent', 70)], 'Math'))['sent']
+        with holding_charts() as held:
+            pending = asyncio.run(renderer.render([60, 70, 80], [('pending', 80)], 'Math', hold=held))['pending']
+
+            # Another job's prune under size pressure
+            assert prune_charts(max_bytes=0) == 1
+            assert not os.path.exists(sent) and os.path.exists(pending)
+    finally:
+        renderer.shutdown()
+
+    assert prune_charts(max_bytes=0) == 1
+    assert not os.path.exists(pending)
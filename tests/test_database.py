@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+
+from benchmarks.fakes import FakeSupabase
+from modules.database import db
+from modules.sqlite_store import SQLiteClient
+
+def write(subject, file_hash, grades):
+    frame = pd.DataFrame({'student_id': list(grades), 'grade': list(grades.values()),
+                          'rank': [1] * len(grades), 'percentile': [100.0] * len(grades)})
+    db.add_grades_bulk(frame, subject, 'test', file_hash=file_hash)
+
+def test_latest_grades_show_only_the_corrected_row_per_subject(fake_db):
+    write('Math', 'v1', {'101': 70})
+    write('Physics', 'p1', {'101': 80})
+    write('Math', 'v2', {'101': 75})
+
+    rows = db.get_latest_grades('101', fields=['subject_name', 'grade'])
+
+    assert [(r['subject_name'], r['grade']) for r in rows] == [('Math', 75.0), ('Physics', 80.0)]
+    # The full history still keeps every version
+    assert len(db.get_grade_history(student_id='101')) == 3
+
+def test_latest_grades_walk_past_a_full_page_of_corrections(fake_db):
+    write('Physics', 'p1', {'101': 80})
+    for version in range(5):
+        write('Math', f"v{version}", {'101': 60 + version})
+
+    rows = db.get_latest_grades('101', page_size=2)
+
+    assert [(r['subject_name'], r['grade']) for r in rows] == [('Math', 64.0), ('Physics', 80.0)]
+
+@pytest.mark.parametrize('backend', ['supabase', 'sqlite'])
+def test_registering_twice_updates_the_existing_user(backend, monkeypatch, tmp_path):
+    client = FakeSupabase() if backend == 'supabase' else SQLiteClient(str(tmp_path / 'grades.db'))
+    monkeypatch.setattr(db, 'client', client)
+
+    assert db.upsert_user({'student_id': '101', 'tg_id': '5001', 'full_name': 'Old Name', 'bot_id': 1})
+    assert db.upsert_user({'student_id': '101', 'tg_id': '5002', 'full_name': 'New Name', 'bot_id': 1})
+
+    rows = client.table('users').select('*').execute().data
+    assert [(r['student_id'], str(r['tg_id']), r['full_name']) for r in rows] == [('101', '5002', 'New Name')]
@@ -0,0 +1,10 @@
+from modules.directory import StudentDirectory
+
+def test_reregistering_from_another_account_forgets_the_old_tg_id():
+    directory = StudentDirectory()
+    directory.upsert({'student_id': '0101', 'tg_id': 5001, 'full_name': 'Student', 'bot_id': 1})
+    directory.upsert({'student_id': '101', 'tg_id': 5002, 'full_name': 'Student', 'bot_id': 1})
+
+    assert directory.get_by_tg_id(5001) is None
+    assert directory.get_by_tg_id(5002)['student_id'] == '101'
+    assert directory.get('101')['tg_id'] == '5002'
@@ -0,0 +1,101 @@
+import asyncio
+
+from benchmarks.fakes import FakeTelegramClient, ALBUM_LIMIT
+from modules.dispatcher import NotificationDispatcher
+
+def make_charts(tmp_path, count):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"chart_{i}.png"
+        path.write_bytes(b'png')
+        paths.append(str(path))
+    return paths
+
+def send(client, *args, **kwargs):
+    async def run():
+        dispatcher = NotificationDispatcher(client, global_rate=1000, per_chat_rate=1000)
+        try:
+            return await dispatcher.send(*args, **kwargs)
+        finally:
+            await dispatcher.stop()
+    return asyncio.run(run())
+
+def test_album_longer_than_limit_is_split(tmp_path):
+    client = FakeTelegramClient(latency=0, upload_latency=0)
+    paths = make_charts(tmp_path, 12)
+
+    assert send(client, 1, "results", file=paths, media_key=[f"k{i}" for i in range(12)])
+
+    assert [len(files) for _, _, files in client.sent] == [ALBUM_LIMIT, 2]
+    assert [caption for _, caption, _ in client.sent] == ["results", ""]
+    assert client.uploads == 12
+
+class FailOnceClient(FakeTelegramClient):
+    """Fails the second album once, after the first was delivered."""
+
+    def __init__(self):
+        super().__init__(latency=0, upload_latency=0)
+        self.failed = False
+
+    async def send_message(self, chat_id, message, file=None):
+        if self.sent and not self.failed:
+            self.failed = True
+            raise ConnectionError("dropped")
+        return await super().send_message(chat_id, message, file=file)
+
+def test_retry_resumes_after_delivered_album_groups(tmp_path):
+    client = FailOnceClient()
+
+    assert send(client, 1, "results", file=make_charts(tmp_path, 11))
+
+    assert [len(files) for _, _, files in client.sent] == [ALBUM_LIMIT, 1]
+
+def test_reused_chart_is_uploaded_once(tmp_path):
+    client = FakeTelegramClient(latency=0, upload_latency=0)
+    path = make_charts(tmp_path, 1)[0]
+
+    async def run():
+        dispatcher = NotificationDispatcher(client, global_rate=1000, per_chat_rate=1000)
+        try:
+            for chat_id in (1, 2, 3):
+                assert await dispatcher.send(chat_id, "result", file=path, media_key='chart')
+            return dispatcher.stats
+        finally:
+            await dispatcher.stop()
+    stats = asyncio.run(run())
+
+    assert client.uploads == 1
+    assert stats['uploads'] == 1 and stats['media_reuses'] == 2
+    assert len(client.sent) == 3
+
+class FailingClient(FakeTelegramClient):
+    async def send_message(self, chat_id, message, file=None):
+        raise ConnectionError("dropped")
+
+def test_idle_chat_buckets_and_old_dead_letters_are_dropped():
+    async def run():
+        dispatcher = NotificationDispatcher(FailingClient(latency=0, upload_latency=0), global_rate=1000,
+                                            per_chat_rate=1000, max_retries=1,
+                                            chat_bucket_limit=2, dead_letter_limit=2)
+        try:
+            for chat_id in range(1, 6):
+                assert not await dispatcher.send(chat_id, "results")
+                await asyncio.sleep(0.01)
+        finally:
+            await dispatcher.stop()
+        return dispatcher
+
+    dispatcher = asyncio.run(run())
+
+    assert list(dispatcher.chat_buckets) == [4, 5]
+    assert [n.chat_id for n in dispatcher.dead_letters] == [4, 5]
+    assert dispatcher.stats['failed'] == 5
+
+def test_chat_bucket_still_throttling_is_kept():
+    async def run():
+        dispatcher = NotificationDispatcher(FakeTelegramClient(), per_chat_rate=0.01, chat_bucket_limit=1)
+        await dispatcher._chat_bucket(1).acquire()
+        dispatcher._chat_bucket(2)
+        return dispatcher
+
+    assert list(asyncio.run(run()).chat_buckets) == [1, 2]
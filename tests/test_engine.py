@@ -0,0 +1,111 @@
+import pandas as pd
+
+from modules.database import db
+from modules.engine import workbook_subject
+
+def write_workbook(path, sheets):
+    with pd.ExcelWriter(path) as writer:
+        for name, grades in sheets.items():
+            pd.DataFrame({'Student ID': ['101', '102', '103'], 'Grade': grades}) \
+                .to_excel(writer, sheet_name=name, index=False)
+    return str(path)
+
+def test_workbook_subject_is_qualified_by_file_name():
+    assert workbook_subject('/tmp/FacultyA.xlsx', 'Sheet1') == 'FacultyA - Sheet1'
+
+def test_generic_sheet_names_stay_separate_subjects(pipeline, tmp_path):
+    pipeline.register(101, 102)
+    first = write_workbook(tmp_path / 'FacultyA.xlsx', {'Sheet1': [90, 80, 70], 'Sheet2': [60, 75, 65]})
+    second = write_workbook(tmp_path / 'FacultyB.xlsx', {'Sheet1': [90, 80, 70], 'Sheet2': [50, 55, 45]})
+
+    assert pipeline.process(first, second) == ['processed', 'processed']
+
+    # Identical "Sheet1" grades in FacultyB are a new subject, not an unchanged re-post
+    assert len(pipeline.client.sent) == 4
+    results = db.get_student_aggregate('101')['results']
+    assert [subject for subject, _ in results] == [
+        'FacultyA - Sheet1', 'FacultyA - Sheet2', 'FacultyB - Sheet1', 'FacultyB - Sheet2']
+
+def test_simultaneous_reposts_are_processed_once(pipeline, tmp_path):
+    import asyncio
+    from modules import engine, notifier
+
+    pipeline.register(101, 102)
+    path = tmp_path / 'Math.csv'
+    pd.DataFrame({'Student ID': ['101', '102'], 'Grade': [90, 80]}).to_csv(path, index=False)
+
+    async def run():
+        try:
+            return await asyncio.gather(*[engine.process_file(str(path), 'test') for _ in range(2)])
+        finally:
+            await notifier.pool.stop()
+
+    assert sorted(asyncio.run(run())) == ['duplicate', 'processed']
+    assert len(pipeline.client.sent) == 2
+    assert not engine._in_flight
+
+def test_slow_bulk_write_does_not_cancel_notifications(pipeline, fake_db, tmp_path, monkeypatch):
+    import time
+    import threading
+    from modules import engine
+
+    pipeline.register(101, 102)
+    write = db.add_grades_bulk
+    written = threading.Event()
+
+    def slow_write(*args, **kwargs):
+        time.sleep(1)
+        try:
+            return write(*args, **kwargs)
+        finally:
+            written.set()
+    monkeypatch.setattr(db, 'add_grades_bulk', slow_write)
+    monkeypatch.setattr(engine, 'GRADE_WRITE_TIMEOUT', 0.2)
+    path = tmp_path / 'Math.csv'
+    pd.DataFrame({'Student ID': ['101', '102'], 'Grade': [90, 80]}).to_csv(path, index=False)
+
+    assert pipeline.process(str(path)) == ['processed']
+    assert len(pipeline.client.sent) == 2
+    # The write carries on in its thread; it must land here, not in the next test's store
+    assert written.wait(10)
+    assert len(fake_db.tables['grades']) == 2
+
+class FlakyGradeStore:
+    """Fails every grades write that contains one of `failing` while it is set."""
+
+    def __init__(self, store, failing):
+        self.store = store
+        self.failing = set(failing)
+
+    def table(self, name):
+        query = self.store.table(name)
+        if name != 'grades':
+            return query
+        upsert = query.upsert
+
+        def failing_upsert(data, on_conflict=None):
+            if self.failing & {row['student_id'] for row in data}:
+                raise ConnectionError("chunk rejected")
+            return upsert(data, on_conflict=on_conflict)
+        query.upsert = failing_upsert
+        return query
+
+def test_failed_grade_chunk_is_retried_on_repost(pipeline, fake_db, tmp_path, monkeypatch):
+    import functools
+
+    pipeline.register(101, 102, 103)
+    flaky = FlakyGradeStore(fake_db, failing={'102'})
+    monkeypatch.setattr(db, 'client', flaky)
+    monkeypatch.setattr(db, 'add_grades_bulk', functools.partial(db.add_grades_bulk, batch_size=1, retries=1))
+    path = tmp_path / 'Math.csv'
+    pd.DataFrame({'Student ID': ['101', '102', '103'], 'Grade': [90, 80, 70]}).to_csv(path, index=False)
+
+    assert pipeline.process(str(path)) == ['partial']
+    assert sorted(chat for chat, _, _ in pipeline.client.sent) == [101, 103]
+    assert db.get_subject_snapshot('Math')['snapshot']['student_id'] == ['101', '103']
+
+    flaky.failing.clear()
+    pipeline.client.sent.clear()
+    assert pipeline.process(str(path)) == ['processed']
+    assert [chat for chat, _, _ in pipeline.client.sent] == [102]
+    assert sorted(r['student_id'] for r in db.get_grade_history(subject='Math')) == ['101', '102', '103']
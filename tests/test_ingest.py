@@ -0,0 +1,70 @@
+import os
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+import pytest
+
+from modules import ingest
+from modules.ingest import read_grade_file, resolve_columns
+
+@pytest.fixture(autouse=True)
+def _shutdown_pool():
+    yield
+    ingest.shutdown_pool()
+
+def make_pdf(path, pages, title="Student Results Fall 2024"):
+    """Writes a PDF whose pages carry `title` above a whitespace-aligned table."""
+    with PdfPages(path) as pdf:
+        for rows in pages:
+            fig = plt.figure(figsize=(8.27, 11.69))
+            fig.text(0.1, 0.95, title, fontsize=14)
+            for r, cells in enumerate(rows):
+                for c, cell in enumerate(cells):
+                    fig.text(0.1 + 0.3 * c, 0.9 - 0.03 * r, str(cell), fontsize=11)
+            pdf.savefig(fig)
+            plt.close(fig)
+
+def test_resolve_columns_never_returns_one_cell_for_both():
+    assert resolve_columns(["Student Results Fall 2024"]) == (None, None)
+    assert resolve_columns(["Student Results Fall 2024", ""]) == (None, None)
+    assert resolve_columns(["Name", "Student ID", "Final Grade"]) == ("Student ID", "Final Grade")
+
+def test_pdf_title_line_is_not_taken_as_header(tmp_path):
+    path = str(tmp_path / "results.pdf")
+    make_pdf(path, [
+        [("ID", "Grade")] + [(1000 + i, 70 + i) for i in range(4)],
+        [("ID", "Grade")] + [(1004 + i, 80 + i) for i in range(4)],
+    ])
+
+    df = read_grade_file(path)
+
+    assert df['student_id'].tolist() == [str(1000 + i) for i in range(8)]
+    assert df['grade'].tolist() == [70.0, 71.0, 72.0, 73.0, 80.0, 81.0, 82.0, 83.0]
+
+def test_in_memory_pdf_reaches_workers_as_one_spooled_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "results.pdf")
+    make_pdf(path, [[("ID", "Grade")] + [(2000 + 4 * p + i, 60 + i) for i in range(4)] for p in range(3)])
+    monkeypatch.setattr(ingest, 'PDF_PAGES_PER_TASK', 1)
+    monkeypatch.setattr('modules.downloads.DOWNLOAD_DIR', str(tmp_path / "spool"))
+
+    submitted = []
+    real_get_pool = ingest._get_pool
+    class RecordingPool:
+        def submit(self, fn, source, *args):
+            submitted.append(source)
+            return real_get_pool().submit(fn, source, *args)
+    monkeypatch.setattr(ingest, '_get_pool', RecordingPool)
+
+    with open(path, 'rb') as f:
+        df = read_grade_file(f.read(), name="results.pdf")
+
+    assert df['student_id'].tolist() == [str(2000 + i) for i in range(12)]
+    assert len(submitted) == 3
+    assert all(isinstance(s, str) for s in submitted) and len(set(submitted)) == 1
+    assert not (tmp_path / "spool").exists() or not any((tmp_path / "spool").iterdir())
+
+def test_workers_are_not_forked_from_the_threaded_main_process():
+    # Children of the fork server, so they hold none of this process's thread locks
+    assert ingest._get_pool().submit(os.getppid).result(timeout=60) != os.getpid()
@@ -0,0 +1,30 @@
+import asyncio
+
+from modules.database import db
+from modules.listener import GradeListener
+
+class BrokenClient:
+    def table(self, name):
+        raise ConnectionError("supabase unreachable")
+
+def test_failed_channel_poll_keeps_previous_set(monkeypatch):
+    listener = GradeListener()
+    listener.monitored_channels = {-1001, -1002}
+    monkeypatch.setattr(db, 'client', BrokenClient())
+    db.cache.invalidate()
+
+    asyncio.run(listener.reload_channels())
+
+    assert listener.monitored_channels == {-1001, -1002}
+
+def test_channel_poll_applies_changes(fake_db):
+    fake_db.table('channels').upsert([
+        {'channel_id': -1001, 'is_active': True},
+        {'channel_id': -1003, 'is_active': False},
+    ]).execute()
+    listener = GradeListener()
+    listener.monitored_channels = {-1001, -1002}
+
+    asyncio.run(listener.reload_channels())
+
+    assert listener.monitored_channels == {-1001}
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_dashboard_mode_execs_gunicorn_before_importing_telegram(tmp_path):
+    # A stand-in gunicorn that records how it was started
+    marker = tmp_path / 'gunicorn.args'
+    fake = tmp_path / 'gunicorn'
+    fake.write_text(f"#!/bin/sh\necho \"$PWD $@\" > {marker}\n")
+    fake.chmod(0o755)
+    env = dict(os.environ, RUN_MODE='dashboard', PATH=f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', os.path.join(ROOT, 'main.py')],
+                            env=env, cwd=tmp_path, capture_output=True, text=True, timeout=60)
+
+    assert result.returncode == 0, result.stderr
+    assert marker.read_text().split() == [ROOT, 'wsgi:app']
+    imported = result.stderr
+    assert 'telethon' not in imported and 'modules.' not in imported
@@ -0,0 +1,53 @@
+from benchmarks.fakes import FakeSupabase
+from modules.sqlite_store import SQLiteClient, WriteBehindReplicator
+
+TEMPLATE = "{subject}: {grade} (rank {rank})"
+
+def settings(client):
+    return {row['key']: row['value'] for row in client.table('settings').select('*').execute().data}
+
+def make_remote():
+    remote = FakeSupabase()
+    remote.table('settings').upsert([
+        {'key': 'result_message_template', 'value': TEMPLATE},
+        {'key': 'welcome_message', 'value': 'Hello!'},
+    ]).execute()
+    return remote
+
+def test_bootstrap_replaces_seeded_settings_with_remote_rows(tmp_path):
+    local = SQLiteClient(str(tmp_path / 'grades.db'), outbox=True)
+    assert settings(local)['result_message_template'] != TEMPLATE
+
+    WriteBehindReplicator(local, make_remote()).bootstrap()
+
+    values = settings(local)
+    assert values['result_message_template'] == TEMPLATE
+    assert values['welcome_message'] == 'Hello!'
+    # Defaults the remote does not override are kept
+    assert 'admin_password_hash' in values
+
+def test_bootstrap_keeps_unreplicated_local_settings(tmp_path):
+    local = SQLiteClient(str(tmp_path / 'grades.db'), outbox=True)
+    local.table('settings').upsert({'key': 'result_message_template', 'value': 'local edit'}).execute()
+
+    WriteBehindReplicator(local, make_remote()).bootstrap()
+
+    assert settings(local)['result_message_template'] == 'local edit'
+
+def test_bootstrapped_timestamps_order_with_local_ones(tmp_path, monkeypatch):
+    from modules.database import db
+    from modules.directory import StudentDirectory
+    remote = FakeSupabase()
+    remote.table('users').insert({'student_id': '101', 'tg_id': 5001,
+                                  'created_at': '2024-05-02T01:30:00.250000+02:00'}).execute()
+    local = SQLiteClient(str(tmp_path / 'grades.db'), outbox=True)
+    WriteBehindReplicator(local, remote).bootstrap()
+    monkeypatch.setattr(db, 'client', local)
+
+    directory = StudentDirectory()
+    directory.load()
+    assert db.get_users_since(directory._last_created_at) == []
+
+    # Written the way SQLite's CURRENT_TIMESTAMP default renders it
+    local.table('users').insert({'student_id': '102', 'tg_id': 5002, 'created_at': '2024-05-01 23:45:00'}).execute()
+    assert [u['student_id'] for u in db.get_users_since(directory._last_created_at)] == ['102']
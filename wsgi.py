@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Same path fix as main.py so `modules` and `config` resolve under gunicorn
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from modules.dashboard import app  # noqa: E402